@@ -1,3 +1,6 @@
+import os
+import time
+import uuid
 from datetime import datetime, timedelta
 from typing import Literal, Optional, List, Union
 from fastapi import (
@@ -11,30 +14,31 @@ from fastapi import (
 )
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import SessionLocal
+from app.cache import CacheBackend, RedisCacheBackend, TTLCache
+from app.database import get_db
+from app.hashing import HashPoolFull, hasher
 from app.api import models
 
 
 router = APIRouter()
 
 
-# Dependency
-def get_db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
-
-
 # Fake key for testing
 SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 180
 
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 30))  # seconds
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 1024))
+USER_CACHE_REDIS_URL = os.environ.get("USER_CACHE_REDIS_URL")
+
+# embed role and status in the token so requests are authorized without the database
+JWT_STATELESS_CLAIMS = os.environ.get("JWT_STATELESS_CLAIMS", "false").lower() == "true"
+
 
 admin_allowed_roles = ["admin"]
 
@@ -58,10 +62,62 @@ class User(BaseModel):
     clients_list_id: Optional[List[str]] = None
 
 
-class UserInDB(User):
+class UserInToken(User):
+    id: Optional[int] = None
+    token_version: int = 0
+
+
+class UserInDB(UserInToken):
     hashed_password: str
 
 
+class TokenRevocations:
+    """Logged out token ids and the minimum valid token version of each user.
+
+    Kept in-process so checking a token needs no database access. With a backend,
+    revocations are shared with the other workers at the cost of a lookup per check.
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None) -> None:
+        self.backend = backend
+        self._revoked: dict[str, float] = {}  # jti: exp timestamp
+        self._min_versions: dict[str, int] = {}  # username: token_version
+
+    async def revoke_token(self, jti: str, expires_at: float) -> None:
+        now = time.time()
+        self._revoked = {k: exp for k, exp in self._revoked.items() if exp > now}
+        self._revoked[jti] = expires_at
+        if self.backend is not None:
+            await self.backend.set(jti, {"exp": expires_at}, max(expires_at - now, 1))
+
+    async def revoke_versions_below(self, username: str, version: int) -> None:
+        self._min_versions[username] = max(self._min_versions.get(username, 0), version)
+        if self.backend is not None:
+            # older tokens have expired by the time this entry does
+            await self.backend.set(
+                "version:" + username,
+                {"version": version},
+                ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+            )
+
+    async def is_revoked(self, payload: dict) -> bool:
+        jti = payload.get("jti")
+        version = payload.get("ver")
+        username = payload["sub"]
+        if jti in self._revoked:
+            return True
+        if version is not None and version < self._min_versions.get(username, 0):
+            return True
+        if self.backend is not None:
+            if jti is not None and await self.backend.get(jti) is not None:
+                return True
+            if version is not None:
+                data = await self.backend.get("version:" + username)
+                if data is not None and version < data["version"]:
+                    return True
+        return False
+
+
 class OAuth2PasswordCookie(OAuth2PasswordBearer):
     """OAuth2 password flow with token in a httpOnly cookie."""
 
@@ -90,40 +146,99 @@ class OAuth2PasswordCookie(OAuth2PasswordBearer):
         return token
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordCookie(tokenUrl="/auth/token")
 
+# authenticated users by username, so get_current_user doesn't query the DB every request
+user_cache = TTLCache(
+    UserInDB,
+    ttl=USER_CACHE_TTL,
+    max_size=USER_CACHE_SIZE,
+    backend=RedisCacheBackend(USER_CACHE_REDIS_URL, prefix="user:")
+    if USER_CACHE_REDIS_URL
+    else None,
+)
+token_revocations = TokenRevocations(
+    backend=RedisCacheBackend(USER_CACHE_REDIS_URL, prefix="revoked:")
+    if USER_CACHE_REDIS_URL
+    else None,
+)
+
 app = FastAPI()
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+hash_pool_full_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Server busy, please try again",
+    headers={"Retry-After": "1"},
+)
 
 
-def get_password_hash(password) -> str:
-    return pwd_context.hash(password)
+async def verify_password(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, Optional[str]]:
+    """Verify the password in the hashing pool.
+    Also returns a new hash if the stored one was made with an outdated bcrypt cost.
+    """
+
+    try:
+        return await hasher.verify_and_update(plain_password, hashed_password)
+    except HashPoolFull:
+        raise hash_pool_full_exception
 
 
-def get_user(username: str) -> Optional[UserInDB]:
+async def get_password_hash(password) -> str:
+    try:
+        return await hasher.hash(password)
+    except HashPoolFull:
+        raise hash_pool_full_exception
+
+
+async def get_user(db: AsyncSession, username: str) -> Optional[UserInDB]:
     """Get User from database by username"""
 
-    db = SessionLocal()
-    user = db.query(models.Users).filter_by(username=username).first()
+    result = await db.execute(select(models.Users).filter_by(username=username))
+    user = result.scalars().first()
     if user is not None:
-        user_dict = dict(user.__dict__)
-        db.close()
-        return UserInDB(**user_dict)
-    db.close()
+        return UserInDB(**dict(user.__dict__))
+
 
+async def get_cached_user(db: AsyncSession, username: str) -> Optional[UserInDB]:
+    """Get User from the user cache, falling back to the database"""
+
+    user = await user_cache.get(username)
+    if user is None:
+        user = await get_user(db, username)
+        if user is not None:
+            await user_cache.set(username, user)
+    return user
 
-def authenticate_user(username: str, password: str) -> Union[UserInDB, Literal[False]]:
+
+async def invalidate_user(username: str) -> None:
+    """Drop the cached User, call it whenever the user's row changes"""
+
+    await user_cache.invalidate(username)
+
+
+async def authenticate_user(
+    db: AsyncSession, username: str, password: str
+) -> Union[UserInDB, Literal[False]]:
     """Return User if the username exists and the password is correct."""
 
-    user = get_user(username)
+    user = await get_user(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await verify_password(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash is not None:  # bcrypt cost changed, rehash transparently
+        await db.execute(
+            update(models.Users)
+            .where(models.Users.username == username)
+            .values(hashed_password=new_hash)
+        )
+        await db.commit()
+        await invalidate_user(username)
+        user.hashed_password = new_hash
     return user
 
 
@@ -138,8 +253,45 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
-    """Return the user from the token."""
+def token_claims(user: UserInToken) -> dict:
+    """Claims identifying the user in a new token.
+    With JWT_STATELESS_CLAIMS, role, status and names are included too.
+    """
+
+    claims = {"sub": user.username, "jti": uuid.uuid4().hex, "ver": user.token_version}
+    if JWT_STATELESS_CLAIMS:
+        claims.update(
+            uid=user.id,
+            role=user.role,
+            disabled=user.disabled,
+            email=user.email,
+            first_name=user.first_name,
+            last_name=user.last_name,
+        )
+    return claims
+
+
+def set_access_token_cookie(response: Response, user: UserInToken) -> None:
+    """Issue a new token for the user in the cookie"""
+
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data=token_claims(user), expires_delta=access_token_expires
+    )
+    # httponly = True, secure = True for production, delete samesite for production
+    response.set_cookie(
+        key="jwt_token",
+        value=access_token,
+        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        path="/",
+        httponly=True,
+        samesite="Lax",
+        secure=False,
+    )
+
+
+async def get_token_payload(token: str = Depends(oauth2_scheme)) -> dict:
+    """Return the payload of a valid, unrevoked token."""
 
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -151,12 +303,49 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
     except JWTError:  # this error includes expired payload.exp
         raise credentials_exception
-    user = get_user(username=token_data.username)
+    if await token_revocations.is_revoked(payload):
+        raise credentials_exception
+    return payload
+
+
+async def get_current_user(
+    payload: dict = Depends(get_token_payload), db: AsyncSession = Depends(get_db)
+) -> UserInToken:
+    """Return the user from the token."""
+
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if JWT_STATELESS_CLAIMS and "role" in payload:
+        # everything needed is in the token, no database access
+        return UserInToken(
+            username=payload["sub"],
+            id=payload.get("uid"),
+            role=payload["role"],
+            disabled=payload.get("disabled"),
+            email=payload.get("email"),
+            first_name=payload.get("first_name"),
+            last_name=payload.get("last_name"),
+            token_version=payload.get("ver", 0),
+        )
+
+    token_data = TokenData(username=payload["sub"])
+    user = await get_cached_user(db, username=token_data.username)
     if user is None:
         raise credentials_exception
+    version = payload.get("ver", user.token_version)
+    if version > user.token_version:
+        # issued after the cached copy was, e.g. by another worker on a password change
+        user = await get_user(db, token_data.username)
+        if user is None:
+            raise credentials_exception
+        await user_cache.set(token_data.username, user)
+    if version != user.token_version:
+        raise credentials_exception  # token issued before e.g. a password change
     return user
 
 
@@ -180,65 +369,59 @@ async def verify_is_admin(
 
 @router.post("/token", response_model=User)
 async def login_for_access_token(
-    response: Response, form_data: OAuth2PasswordRequestForm = Depends()
+    response: Response,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_db),
 ) -> UserInDB:
     """Login and return a JWT token in a cookie."""
 
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
-    # httponly = True, secure = True for production, delete samesite for production
-    response.set_cookie(
-        key="jwt_token",
-        value=access_token,
-        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        path="/",
-        httponly=True,
-        samesite="Lax",
-        secure=False,
-    )
+    set_access_token_cookie(response, user)
     return user
 
 
 @router.post("/login", response_model=User)
 async def login_active_user(
-    response: Response, current_user: User = Depends(get_current_active_user)
+    response: Response,
+    payload: dict = Depends(get_token_payload),
+    db: AsyncSession = Depends(get_db),
 ) -> User:
     """Check cookie for authentication, refresh cookie's token if it's valid.
     This is also being used for refreshing access token on the frontend.
+    The user is read from the database, so even with JWT_STATELESS_CLAIMS a new
+    token never outlives a role change, a disabled account or a password change.
     """
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": current_user.username}, expires_delta=access_token_expires
-    )
-
-    # httponly = True, secure = True, delete samesite for production
-    response.set_cookie(
-        key="jwt_token",
-        value=access_token,
-        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        path="/",
-        httponly=True,
-        samesite="Lax",
-        secure=False,
-    )
-    return current_user
+    user = await get_user(db, payload["sub"])
+    if user is None or payload.get("ver", user.token_version) != user.token_version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    await user_cache.set(user.username, user)
+    set_access_token_cookie(response, user)
+    return user
 
 
 @router.post("/logout")
 async def logout_user(
-    response: Response, current_user: User = Depends(get_current_active_user)
+    response: Response,
+    current_user: User = Depends(get_current_active_user),
+    payload: dict = Depends(get_token_payload),
 ) -> dict[str, str]:
-    """Sign out, set token to expired"""
+    """Sign out, revoke the token and set it to expired"""
+
+    if "jti" in payload:
+        await token_revocations.revoke_token(payload["jti"], payload["exp"])
 
     access_token_expires = timedelta(minutes=-15)
     access_token = create_access_token(
@@ -0,0 +1,154 @@
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, insert, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api import models
+from app.api.coaching_log_versions import (
+    CURRENT_COACHING_LOG_VERSION,
+    upgrade_coaching_log_data,
+)
+
+# a full snapshot every this many revisions bounds the diffs applied to rebuild one
+SNAPSHOT_INTERVAL = int(os.environ.get("COACHING_LOG_SNAPSHOT_INTERVAL", 20))
+
+
+def diff_data(old: dict, new: dict) -> dict:
+    """The top level keys `new` sets and the ones it drops compared to `old`.
+    Answers are replaced whole, the history grows with what an edit changes.
+    """
+
+    diff = {}
+    changed = {
+        key: value for key, value in new.items() if key not in old or old[key] != value
+    }
+    if changed:
+        diff["set"] = changed
+    removed = [key for key in old if key not in new]
+    if removed:
+        diff["unset"] = removed
+    return diff
+
+
+def apply_diff(data: dict, diff: dict) -> dict:
+    """Inverse of diff_data: the document `diff` was made to"""
+
+    unset = set(diff.get("unset", ()))
+    data = {key: value for key, value in data.items() if key not in unset}
+    data.update(diff.get("set", {}))
+    return data
+
+
+async def record_revision(
+    db: AsyncSession,
+    coaching_log_id: int,
+    revision: int,
+    diff: Optional[dict] = None,
+    edited_by: Optional[str] = None,
+    edited_at: Optional[datetime] = None,
+) -> None:
+    """Append `revision` of the coaching log after it was created or edited, from
+    `diff` to the revision before. Without a diff, every SNAPSHOT_INTERVAL revisions,
+    when the form version changed and on the log's first revision, the document is
+    copied instead, within the database. Logs edited before revisions were recorded
+    start their history then.
+    """
+
+    await db.flush()  # a snapshot is read from the log in the database
+    revisions = models.Coaching_log_revisions
+    result = await db.execute(
+        select(
+            select(revisions.version)
+            .filter_by(coaching_log_id=coaching_log_id)
+            .order_by(revisions.revision.desc())
+            .limit(1)
+            .scalar_subquery()
+            .label("version"),
+            select(func.max(revisions.revision))
+            .filter_by(coaching_log_id=coaching_log_id, snapshot=True)
+            .scalar_subquery()
+            .label("snapshot"),
+        )
+    )
+    last = result.first()
+    if (
+        diff is None
+        or last.snapshot is None
+        or last.version != CURRENT_COACHING_LOG_VERSION
+        or revision - last.snapshot >= SNAPSHOT_INTERVAL
+    ):
+        logs = models.Coaching_logs
+        await db.execute(
+            insert(revisions).from_select(
+                [
+                    "coaching_log_id",
+                    "revision",
+                    "snapshot",
+                    "version",
+                    "data",
+                    "edited_by",
+                    "edited_at",
+                ],
+                select(
+                    logs.id,
+                    logs.row_version,
+                    true(),
+                    logs.version,
+                    logs.data_jsonb,
+                    logs.edited_by,
+                    logs.edited_at,
+                ).filter(logs.id == coaching_log_id),
+            )
+        )
+    else:
+        db.add(
+            revisions(
+                coaching_log_id=coaching_log_id,
+                revision=revision,
+                snapshot=False,
+                version=CURRENT_COACHING_LOG_VERSION,
+                data=diff,
+                edited_by=edited_by,
+                edited_at=edited_at,
+            )
+        )
+
+
+async def get_revision(
+    db: AsyncSession, coaching_log_id: int, revision: int
+) -> Optional[dict]:
+    """Rebuild `revision` of the coaching log from the latest snapshot up to it and
+    the diffs after, with its data upgraded to the current version. None if there is
+    no such revision.
+    """
+
+    revisions = models.Coaching_log_revisions
+    last_snapshot = (
+        select(func.max(revisions.revision))
+        .filter_by(coaching_log_id=coaching_log_id, snapshot=True)
+        .filter(revisions.revision <= revision)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        select(revisions)
+        .filter_by(coaching_log_id=coaching_log_id)
+        .filter(revisions.revision.between(last_snapshot, revision))
+        .order_by(revisions.revision)
+    )
+    rows = result.scalars().all()
+    if not rows or rows[-1].revision != revision:
+        return None
+
+    data = rows[0].data
+    for row in rows[1:]:
+        data = apply_diff(data, row.data)
+    last = rows[-1]
+    return {
+        "revision": last.revision,
+        "version": CURRENT_COACHING_LOG_VERSION,
+        "data": upgrade_coaching_log_data(last.version, data),
+        "edited_by": last.edited_by,
+        "edited_at": last.edited_at,
+    }
@@ -0,0 +1,87 @@
+from typing import Callable, Optional
+
+from sqlalchemy import case
+
+from app.api import models
+
+CURRENT_COACHING_LOG_VERSION = "1.1"
+LEGACY_COACHING_LOG_VERSION = "1.0"  # logs stored without a version
+
+# version: (next version, function upgrading a payload to it)
+coaching_log_upgrades: dict[str, tuple[str, Callable[[dict], dict]]] = {}
+
+
+def upgrade(from_version: str, to_version: str):
+    """Register a function upgrading coaching log data from_version to_version"""
+
+    def register(function: Callable[[dict], dict]) -> Callable[[dict], dict]:
+        coaching_log_upgrades[from_version] = (to_version, function)
+        return function
+
+    return register
+
+
+@upgrade("1.0", "1.1")
+def add_session_duration(data: dict) -> dict:
+    """1.1 added the session duration"""
+
+    return {**data, "ansSessionDuration": data.get("ansSessionDuration")}
+
+
+def upgrade_coaching_log_data(version: Optional[str], data: dict) -> dict:
+    """Upgrade coaching log data of `version` step by step to the current version.
+    Raises ValueError if there is no way there.
+    """
+
+    version = version or LEGACY_COACHING_LOG_VERSION
+    while version != CURRENT_COACHING_LOG_VERSION:
+        if version not in coaching_log_upgrades:
+            raise ValueError(f"Unknown coaching log version: {version}")
+        version, step = coaching_log_upgrades[version]
+        data = step(data)
+    return data
+
+
+def can_upgrade(version: Optional[str]) -> bool:
+    """Whether data of `version` can be upgraded to the current version"""
+
+    version = version or LEGACY_COACHING_LOG_VERSION
+    while version != CURRENT_COACHING_LOG_VERSION:
+        if version not in coaching_log_upgrades:
+            return False
+        version = coaching_log_upgrades[version][0]
+    return True
+
+
+def coaching_log_data_columns() -> list:
+    """`data` and `legacy_data` columns for coaching_log_row: the migrated data_jsonb,
+    and the data column only for the rows not migrated yet
+    """
+
+    logs = models.Coaching_logs
+    return [
+        logs.data_jsonb.label("data"),
+        case((logs.data_jsonb.is_(None), logs.data)).label("legacy_data"),
+    ]
+
+
+def coaching_log_row(row) -> dict:
+    """A coaching log row selected with coaching_log_data_columns as a dict,
+    with its data upgraded to the current version. Logs of an unknown version keep
+    their version and data as stored, whether the data was selected or not.
+    """
+
+    coaching_log = dict(row)
+    legacy_data = coaching_log.pop("legacy_data", None)
+    if legacy_data is not None:
+        try:
+            coaching_log["data"] = upgrade_coaching_log_data(
+                coaching_log["version"], legacy_data
+            )
+        except ValueError:
+            coaching_log["data"] = legacy_data  # served as stored
+            return coaching_log
+    elif not can_upgrade(coaching_log["version"]):
+        return coaching_log
+    coaching_log["version"] = CURRENT_COACHING_LOG_VERSION
+    return coaching_log
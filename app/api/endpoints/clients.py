@@ -1,28 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, Form
+from fastapi.responses import StreamingResponse
 from app.api.auth import User, get_current_active_user, verify_is_admin
 
-from typing import Optional, List
-from pydantic import BaseModel
+from typing import Optional, List, Any, Dict
+from pydantic import BaseModel, ValidationError, root_validator, validator
 
-from sqlalchemy.orm import Session
-from app.database import SessionLocal
+from sqlalchemy import case, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
 from app.api import models
+from app.api.endpoints.dashboard import refresh_coach_summaries, update_coach_summary
+from app.util import (
+    STREAM_BATCH_SIZE,
+    TrustedJSONResponse,
+    check_page_limit,
+    etag_matches,
+    json_dumps,
+    make_etag,
+    model_columns,
+    not_modified,
+    set_etag,
+    stream_ndjson,
+)
 
+import csv
+import hashlib
+import hmac
+import io
+import os
 import random
 import json
 
 router = APIRouter()
 
 
-# Dependency
-def get_db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
-
-
 class ClientName(BaseModel):
     first_name: str
     last_name: str
@@ -50,6 +62,68 @@ class ClientDetails(ClientName):
     current_location: str
 
 
+class ClientImport(BaseModel):
+    """One row of a bulk import, `dq` may be given as a JSON string (CSV)"""
+
+    first_name: str
+    last_name: str
+    email: str
+    mobile_phone: str
+    sex: str
+    age: int
+    current_location: str
+    dq: List[List[str]]  # [0]: question, [1]: answer
+
+    @validator("dq", pre=True)
+    def parse_dq(cls, value):
+        if isinstance(value, str):
+            try:
+                return json.loads(value)
+            except ValueError:
+                raise ValueError("dq is not valid JSON")
+        return value
+
+
+class RowError(BaseModel):
+    row: int  # 1-based record number, the CSV header isn't counted
+    errors: List[dict[str, Any]]
+
+
+class BulkCreateResult(BaseModel):
+    created: int
+    client_ids: List[int]  # in row order, valid rows only
+    errors: List[RowError]
+
+
+class BulkAssignment(BaseModel):
+    """Either `assignments` (client_id: coach_username), or move every client of
+    `from_coach` to `to_coach`
+    """
+
+    assignments: Optional[Dict[int, str]]
+    from_coach: Optional[str]
+    to_coach: Optional[str]
+
+    @root_validator
+    def one_operation(cls, values):
+        mapping = values.get("assignments") is not None
+        move = [values.get("from_coach"), values.get("to_coach")]
+        if mapping == any(move) or not mapping and not all(move):
+            raise ValueError("give either assignments or from_coach and to_coach")
+        return values
+
+
+class BulkAssignmentResult(BaseModel):
+    updated: int
+
+
+IMPORT_BATCH_SIZE = 1000  # rows per INSERT / id lookup
+MAX_SEARCH_LIMIT = 50
+
+CLIENT_ID_KEY = os.environ.get("CLIENT_ID_KEY", "change-me").encode()
+CLIENT_ID_ROUNDS = 4
+
+
 def generate_client_id() -> int:
     """generate random client_id (int) [0, 999999], collision isn't handled"""
 
@@ -57,42 +131,198 @@ def generate_client_id() -> int:
     return new_id
 
 
+def permute_client_id(position: int) -> int:
+    """Map a sequence position in [0, 999999] to a client id in the same range.
+    A keyed Feistel network on the two 3-digit halves: a bijection, so distinct
+    positions give distinct ids, and without the key consecutive ids look random.
+    """
+
+    left, right = divmod(position, 1000)
+    for i in range(CLIENT_ID_ROUNDS):
+        digest = hmac.new(
+            CLIENT_ID_KEY, f"{i}:{right}".encode(), hashlib.sha256
+        ).digest()
+        left, right = right, (left + int.from_bytes(digest[:4], "big")) % 1000
+    return left * 1000 + right
+
+
+async def allocate_client_ids(db: AsyncSession, count: int) -> list[int]:
+    """Allocate `count` unique client ids: take positions from client_id_seq in one
+    query and permute them, so concurrent creates never race onto the same id.
+    Ids drawn randomly before the sequence existed may still be taken, one IN query
+    skips those. SQLite has no sequences, there random ids are checked the same way.
+    """
+
+    allocated: list[int] = []
+    while len(allocated) < count:
+        needed = count - len(allocated)
+        if db.bind.dialect.name == "postgresql":
+            positions = await db.execute(
+                select(models.client_id_seq.next_value()).select_from(
+                    func.generate_series(1, needed)
+                )
+            )
+            candidates = [permute_client_id(p) for p in positions.scalars()]
+        else:
+            candidates = list(
+                {generate_client_id() for _ in range(needed)} - set(allocated)
+            )
+
+        for start in range(0, len(candidates), IMPORT_BATCH_SIZE):
+            batch = candidates[start : start + IMPORT_BATCH_SIZE]
+            result = await db.execute(
+                select(models.Clients.id).filter(models.Clients.id.in_(batch))
+            )
+            taken = set(result.scalars().all())
+            allocated += [client_id for client_id in batch if client_id not in taken]
+    return allocated
+
+
+def parse_client_import(body: str, content_type: str) -> list[tuple[int, Any]]:
+    """Split a CSV (with header) or JSON lines body into (row number, record).
+    A record is a dict, or a ValueError if the line isn't a JSON object or the CSV
+    row has more fields than the header.
+    """
+
+    if content_type.startswith("text/csv"):
+        records = []
+        # newline="" leaves the line breaks inside quoted fields to the csv module
+        reader = csv.DictReader(io.StringIO(body, newline=""))
+        for row, record in enumerate(reader, start=1):
+            if None in record:  # DictReader keys the extra fields with None
+                record = ValueError("more fields than the header")
+            records.append((row, record))
+        return records
+
+    records = []
+    # only "\n" ends a line, JSON strings may hold the other breaks splitlines knows
+    lines = (line for line in body.split("\n") if line.strip())
+    for row, line in enumerate(lines, start=1):
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            record = e
+        records.append((row, record))
+    return records
+
+
 @router.get("/list", response_model=List[ClientName])
 async def list_accessible_clients(
-    db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
 ) -> list[ClientName]:
-    """list all the clients this User has access to"""
+    """list all the clients this User has access to.
+    Answers If-None-Match with 304 when no client was added, removed or changed.
+    """
+
+    # any change to the list moves the latest updated_at or the count. Bulk changes
+    # stamp many rows alike, the username tells apart the lists of two coaches
+    result = await db.execute(
+        select(func.max(models.Clients.updated_at), func.count()).filter_by(
+            coach_username=current_user.username
+        )
+    )
+    etag = make_etag(current_user.username, *result.one())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    # same rows as Users.clients_list, without loading the user first
+    result = await db.execute(
+        select(*model_columns(ClientName, models.Clients))
+        .filter_by(coach_username=current_user.username)
+        .order_by(models.Clients.id)
+    )
+    response = TrustedJSONResponse([dict(row) for row in result.mappings()])
+    set_etag(response, etag)
+    return response
 
-    clients_list = (
-        db.query(models.Users)
-        .filter_by(username=current_user.username)
-        .first()
-        .clients_list
+
+@router.get("/search", response_model=List[ClientDetails])
+async def search_clients(
+    q: str,
+    limit: int = 10,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+) -> list[ClientDetails]:
+    """Typeahead search of clients by name, email or mobile phone. Names starting
+    with `q` come first, then emails and phones starting with it, then the other
+    matches, including misspellings (postgres only). Coaches search their clients,
+    admin searches all.
+    """
+
+    check_page_limit(limit, MAX_SEARCH_LIMIT)
+    q = q.strip().lower()
+    if not q:
+        return TrustedJSONResponse([])
+
+    pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    text = models.clients_search_text
+    contains = text.like(f"%{pattern}%", escape="\\")
+    prefix_rank = case(
+        (
+            or_(
+                func.lower(models.Clients.first_name).like(f"{pattern}%", escape="\\"),
+                func.lower(models.Clients.last_name).like(f"{pattern}%", escape="\\"),
+            ),
+            0,
+        ),
+        (
+            or_(
+                func.lower(models.Clients.email).like(f"{pattern}%", escape="\\"),
+                models.Clients.mobile_phone.like(f"{pattern}%", escape="\\"),
+            ),
+            1,
+        ),
+        else_=2,
     )
 
-    clients = []
-    for client in clients_list:
-        clients.append(client.__dict__)
-    return clients
+    query = select(*model_columns(ClientDetails, models.Clients))
+    if db.bind.dialect.name == "postgresql":
+        # both conditions can use the pg_trgm index on clients_search_text
+        fuzzy = literal(q).op("<%")(text)  # a word of text is similar to q
+        query = query.filter(or_(contains, fuzzy)).order_by(
+            prefix_rank, func.word_similarity(q, text).desc(), models.Clients.id
+        )
+    else:
+        query = query.filter(contains).order_by(prefix_rank, models.Clients.id)
+    if current_user.role != "admin":
+        query = query.filter_by(coach_username=current_user.username)
+
+    result = await db.execute(query.limit(limit))
+    return TrustedJSONResponse([dict(row) for row in result.mappings()])
 
 
 @router.get("/details/{client_id}", response_model=ClientCoachName)
 async def list_client_details(
-    client_id: str,
-    db: Session = Depends(get_db),
+    client_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ) -> ClientCoachName:
-    """list client's details by cilent_id. Only allows admin or client's coach to access"""
+    """list client's details by cilent_id. Only allows admin or client's coach to access.
+    Answers If-None-Match with 304 when the client hasn't changed.
+    """
 
-    client = db.query(models.Clients).filter_by(id=client_id).first()
+    result = await db.execute(select(models.Clients).filter_by(id=client_id))
+    client = result.scalars().first()
     if client and (
         client.coach_username == current_user.username or current_user.role == "admin"
     ):
+        # admin and coach get different coach_details
+        etag = make_etag(client_id, client.updated_at, current_user.role)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
         if current_user.role == "admin":
             # only need to query coach name if user is admin
-            coach = (
-                db.query(models.Users).filter_by(username=client.coach_username).first()
+            result = await db.execute(
+                select(models.Users).filter_by(username=client.coach_username)
             )
+            coach = result.scalars().first()
             if coach:
                 coach_details = coach.__dict__  # the user is admin but not the coach
             else:
@@ -127,16 +357,12 @@ async def create_client(
     age: str = Form(...),
     current_location: str = Form(...),
     dq: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(verify_is_admin),
 ) -> dict[str, int]:
     """create a new client and returns the client_id. Only admin can access"""
     age = int(age)
-    client_id = generate_client_id()
-
-    # Collision test
-    while db.query(models.Clients.id).filter_by(id=client_id).first() is not None:
-        client_id = generate_client_id()
+    (client_id,) = await allocate_client_ids(db, 1)
 
     dq = json.loads(dq)  # 2D list type, [0]: question, [1]: answer
 
@@ -160,13 +386,99 @@ async def create_client(
     )
 
     db.add(new_client)
-    db.flush()  # generate new client_id
+    await db.flush()  # generate new client_id
     db.add(new_dq)
-    db.commit()
+    await db.commit()
 
     return {"client_id": client_id}
 
 
+@router.post(
+    "/bulk-create",
+    response_model=BulkCreateResult,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "text/csv": {"schema": {"type": "string"}},
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+        }
+    },
+)
+async def bulk_create_clients(
+    request: Request,
+    partial: bool = False,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(verify_is_admin),
+) -> BulkCreateResult:
+    """create clients with their discovery questionnaires from a CSV (text/csv, with a
+    header row, `dq` as a JSON string) or JSON lines body, in one transaction.
+    Any invalid row fails the whole import with 422 and the per-row errors, unless
+    `partial` is set, then the valid rows are created and the errors are returned.
+    Only admin can access
+    """
+
+    try:
+        body = (await request.body()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body must be UTF-8")
+    records = parse_client_import(body, request.headers.get("content-type", ""))
+
+    rows: list[ClientImport] = []
+    errors: list[RowError] = []
+    for row, record in records:
+        if isinstance(record, ValueError):
+            errors.append(
+                RowError(
+                    row=row,
+                    errors=[{"loc": [], "msg": str(record), "type": "value_error"}],
+                )
+            )
+            continue
+        try:
+            rows.append(ClientImport(**record))
+        except ValidationError as e:
+            errors.append(RowError(row=row, errors=e.errors()))
+    if errors and not partial:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=[error.dict() for error in errors],
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    client_ids = await allocate_client_ids(db, len(rows))
+    clients = []
+    dqs = []
+    for client_id, row in zip(client_ids, rows):
+        clients.append(
+            dict(
+                row.dict(exclude={"dq"}),
+                id=client_id,
+                coach_username=None,
+                created_by=current_user.username,
+            )
+        )
+        dqs.append(dict(client_id=client_id, version="1.1", data=row.dq))
+
+    try:
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            batch = slice(start, start + IMPORT_BATCH_SIZE)
+            await db.execute(insert(models.Clients), clients[batch])
+            await db.execute(insert(models.Client_discovery_questionnaire), dqs[batch])
+        await db.commit()
+    except IntegrityError:
+        # a client created concurrently took one of the ids, nothing was written
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Client ID conflict, please retry",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    return {"created": len(client_ids), "client_ids": client_ids, "errors": errors}
+
+
 @router.post(
     "/assign-coach",
     dependencies=[Depends(verify_is_admin)],
@@ -174,14 +486,16 @@ async def create_client(
 )
 async def assign_coach_to_client(
     coach_username: str = Form(...),
-    client_id: str = Form(...),
-    db: Session = Depends(get_db),
+    client_id: int = Form(...),
+    db: AsyncSession = Depends(get_db),
 ) -> ClientCoachName:
     """Assign the coach to the given client by coach_username and client_id. Only admin can access"""
 
     # will not show error if the new coach is the same as the current coach
-    coach = db.query(models.Users).filter_by(username=coach_username).first()
-    client = db.query(models.Clients).filter_by(id=client_id).first()
+    result = await db.execute(select(models.Users).filter_by(username=coach_username))
+    coach = result.scalars().first()
+    result = await db.execute(select(models.Clients).filter_by(id=client_id))
+    client = result.scalars().first()
     if coach is None:
         raise HTTPException(
             status_code=404,
@@ -194,10 +508,15 @@ async def assign_coach_to_client(
             detail="Client ID not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    previous_coach = client.coach_username
     client.coach_username = coach.username
+    if previous_coach != coach.username:
+        await db.flush()  # a summary counted afresh must see the new coach
+        await update_coach_summary(db, previous_coach, clients=-1)
+        await update_coach_summary(db, coach.username, clients=1)
     client_details = dict(client.__dict__)
     coach_details = dict(coach.__dict__)
-    db.commit()
+    await db.commit()
 
     return {
         "client_details": client_details,
@@ -205,21 +524,125 @@ async def assign_coach_to_client(
     }
 
 
+@router.post(
+    "/assign-coach/bulk",
+    dependencies=[Depends(verify_is_admin)],
+    response_model=BulkAssignmentResult,
+)
+async def bulk_assign_coach(
+    assignment: BulkAssignment,
+    db: AsyncSession = Depends(get_db),
+) -> BulkAssignmentResult:
+    """Assign many clients in one transaction, by a client_id: coach_username mapping
+    or by moving all clients of one coach to another. Every coach and client must
+    exist, otherwise nothing is changed. Only admin can access
+    """
+
+    coaches = (
+        set(assignment.assignments.values())
+        if assignment.assignments is not None
+        else {assignment.to_coach}
+    )
+    result = await db.execute(
+        select(models.Users.username).filter(models.Users.username.in_(coaches))
+    )
+    missing_coaches = coaches - set(result.scalars().all())
+    if missing_coaches:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Username not found: {', '.join(sorted(missing_coaches))}",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    if assignment.assignments is None:
+        result = await db.execute(
+            update(models.Clients)
+            .filter_by(coach_username=assignment.from_coach)
+            .values(coach_username=assignment.to_coach)
+            .execution_options(synchronize_session=False)
+        )
+        await refresh_coach_summaries(db, [assignment.from_coach, assignment.to_coach])
+        await db.commit()
+        return {"updated": result.rowcount}
+
+    client_ids = list(assignment.assignments)
+    found = set()
+    for start in range(0, len(client_ids), IMPORT_BATCH_SIZE):
+        batch = client_ids[start : start + IMPORT_BATCH_SIZE]
+        result = await db.execute(
+            select(models.Clients.id, models.Clients.coach_username)
+            .filter(models.Clients.id.in_(batch))
+            .with_for_update()
+        )
+        for client_id, coach_username in result:
+            found.add(client_id)
+            coaches.add(coach_username)
+    missing_clients = [client_id for client_id in client_ids if client_id not in found]
+    if missing_clients:
+        await db.rollback()
+        raise HTTPException(
+            status_code=404,
+            detail=f"Client ID not found: {', '.join(map(str, missing_clients))}",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    updated = 0
+    for start in range(0, len(client_ids), IMPORT_BATCH_SIZE):
+        batch = client_ids[start : start + IMPORT_BATCH_SIZE]
+        # one UPDATE per batch, the new coach picked by a CASE on the client id
+        coach_of = case(
+            {client_id: assignment.assignments[client_id] for client_id in batch},
+            value=models.Clients.id,
+        )
+        result = await db.execute(
+            update(models.Clients)
+            .filter(models.Clients.id.in_(batch))
+            .values(coach_username=coach_of)
+            .execution_options(synchronize_session=False)
+        )
+        updated += result.rowcount
+    # previous and new coaches, recounted in one statement
+    coaches.discard(None)
+    await refresh_coach_summaries(db, coaches)
+    await db.commit()
+    return {"updated": updated}
+
+
 @router.get(
     "/list-all",
     dependencies=[Depends(verify_is_admin)],
     response_model=List[ClientDetails],
 )
 async def list_all_clients(
-    limit: int = -1, skip: int = 0, db: Session = Depends(get_db)
+    limit: int = -1,
+    skip: int = 0,
+    after: Optional[int] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(get_db),
 ) -> list[ClientDetails]:
-    """list all the clients in the database. Only admin can access"""
+    """list all the clients in the database. Only admin can access.
+    Pages are keyed on client id: pass the X-Next-Cursor header of a page as `after`
+    to get the next one. `stream` returns NDJSON read from a server-side cursor.
+    """
+
+    check_page_limit(limit)
+    query = select(*model_columns(ClientDetails, models.Clients)).order_by(
+        models.Clients.id
+    )
+    if after is not None:
+        query = query.filter(models.Clients.id > after)
+    if limit != -1:  # -1 is a temporary fix to query the whole table
+        query = query.limit(limit).offset(skip)
+
+    if stream:
+        result = await db.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        return StreamingResponse(
+            stream_ndjson(result.mappings(), lambda client: json_dumps(dict(client))),
+            media_type="application/x-ndjson",
+        )
 
-    if limit == -1:  # temporary fix to query the whole table
-        clients_list = db.query(models.Clients).order_by(models.Clients.id).all()
-    else:
-        clients_list = db.query(models.Clients).limit(limit).offset(skip)
-    clients = []
-    for client in clients_list:
-        clients.append(client.__dict__)
-    return clients
+    clients = [dict(row) for row in (await db.execute(query)).mappings()]
+    response = TrustedJSONResponse(clients)
+    if clients and len(clients) == limit:
+        response.headers["X-Next-Cursor"] = str(clients[-1]["id"])
+    return response
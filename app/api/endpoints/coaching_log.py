@@ -1,28 +1,58 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from app.api.auth import get_current_active_user, User
 
-from typing import Optional, List
+from typing import Dict, Literal, Optional, List, Sequence
 from pydantic import BaseModel
 
-from sqlalchemy.orm import Session
-from app.database import SessionLocal
+from sqlalchemy import (
+    Text,
+    cast,
+    func,
+    literal,
+    literal_column,
+    null,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSON, JSONB, array
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+from app.database import get_db
 from app.api import models
+from app.api.coaching_log_revisions import diff_data, get_revision, record_revision
+from app.api.coaching_log_versions import (
+    CURRENT_COACHING_LOG_VERSION,
+    can_upgrade,
+    coaching_log_data_columns,
+    coaching_log_row,
+    upgrade_coaching_log_data,
+)
+from app.api.endpoints.dashboard import update_coach_summary
+from app.util import (
+    TrustedJSONResponse,
+    check_page_limit,
+    decode_cursor,
+    encode_cursor,
+    etag_matches,
+    if_match_holds,
+    make_etag,
+    merge_patch,
+    model_columns,
+    not_modified,
+    set_etag,
+)
 
 from datetime import datetime, timezone
 
 
-# Dependency
-def get_db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
-
-
 router = APIRouter()
 
-CURRENT_COACHING_LOG_VERSION = "1.1"
+MAX_BATCH_CLIENTS = 500  # client ids per /batch request
+MAX_SEARCH_LIMIT = 100
+SEARCH_HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=20, MinWords=5"
+# inlined, a bound parameter would be text and not resolve to the regconfig overloads
+SEARCH_CONFIG = literal_column("'english'")
 
 
 class CoachingLogData(BaseModel):
@@ -42,35 +72,197 @@ class CoachingLogData(BaseModel):
 
 
 class CoachingLog(BaseModel):
+    id: int
     version: str
-    data: CoachingLogData
+    data: Optional[CoachingLogData]  # None when only metadata is requested
     locked: bool
     created_by: str
     created_at: datetime
     edited_by: str
     edited_at: datetime
+    row_version: int  # see coaching_log_etag
+
+
+def coaching_log_columns(fields: Literal["all", "metadata"]) -> list:
+    """Columns of CoachingLog, turn the rows into CoachingLogs with coaching_log_row.
+    `data` is NULL when only metadata is requested. The data JSON is returned as
+    stored (upgraded to the current version), not checked against CoachingLogData.
+    """
+
+    columns = []
+    for column in model_columns(CoachingLog, models.Coaching_logs):
+        if column.key != "data":
+            columns.append(column)
+        elif fields == "metadata":
+            columns.append(null().label("data"))
+        else:
+            columns.extend(coaching_log_data_columns())
+    return columns
+
+
+def current_version_data(version: str, coaching_log_data: dict) -> dict:
+    """Coaching log data sent at `version`, upgraded to the current version"""
+
+    try:
+        return upgrade_coaching_log_data(version, coaching_log_data)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+def coaching_log_etag(coaching_log_id: int, row_version: int) -> str:
+    """Strong ETag of a coaching log, for the If-Match of edits. Carries the id too,
+    the last log of a client changes when a new one is created.
+    """
+
+    return f'"{coaching_log_id}.{row_version}"'
+
+
+def check_if_match(request: Request, coaching_log: models.Coaching_logs) -> None:
+    """409 when the coaching log was edited since the ETag in If-Match was given out"""
+
+    etag = coaching_log_etag(coaching_log.id, coaching_log.row_version)
+    if not if_match_holds(request, etag):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Coaching log was edited in the meantime",
+            headers={"ETag": etag},
+        )
+
+
+async def get_coaching_log_data(db: AsyncSession, coaching_log_id: int) -> dict:
+    """The coaching log's data, upgraded to the current version"""
+
+    result = await db.execute(
+        select(models.Coaching_logs.version, *coaching_log_data_columns()).filter(
+            models.Coaching_logs.id == coaching_log_id
+        )
+    )
+    return coaching_log_row(result.first())["data"] or {}
+
+
+class Revision(BaseModel):
+    revision: int  # the row_version of the coaching log after the edit
+    edited_by: str
+    edited_at: datetime
+
+
+class CoachingLogRevision(Revision):
+    version: str
+    data: dict
+
+
+class SearchResult(BaseModel):
+    id: int
+    client_id: int
+    created_by: str
+    created_at: datetime
+    rank: float
+    snippet: str  # matching answer fragments, matches wrapped in <b></b>
 
 
 class Message(BaseModel):
     message: str
 
 
+async def get_latest_coaching_log(
+    db: AsyncSession, client_id: int, load_options: Sequence = ()
+) -> Optional[models.Coaching_logs]:
+    """Return the client's latest coaching log, locked FOR UPDATE.
+    A single lookup on the (client_id, created_at) index, however many logs there are.
+    """
+
+    result = await db.execute(
+        select(models.Coaching_logs)
+        .filter_by(client_id=client_id)
+        .order_by(
+            models.Coaching_logs.created_at.desc(), models.Coaching_logs.id.desc()
+        )
+        .limit(1)
+        .options(*load_options)
+        .with_for_update()
+    )
+    return result.scalars().first()
+
+
 @router.get("/list/{client_id}", response_model=List[CoachingLog])
 async def list_all_coaching_logs(
-    client_id: str,
+    client_id: int,
+    request: Request,
+    limit: int = -1,
+    after: Optional[str] = None,
+    since: Optional[datetime] = None,
+    fields: Literal["all", "metadata"] = "all",
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> list[CoachingLog]:
-    """List all coaching_logs of this client_id if the current_user is his/her coach or admin"""
+    """List coaching_logs of this client_id if the current_user is his/her coach or admin.
+    Logs are ordered by created_at. `limit` sets the page size, pass the X-Next-Cursor
+    header of a page as `after` to get the next one. `since` only returns the logs
+    created or edited since then, `fields=metadata` leaves out the log data.
+    Answers If-None-Match with 304 when no log was added or edited.
+    """
 
-    client = db.query(models.Clients).filter_by(id=client_id).first()
+    check_page_limit(limit)
+    # the client's coach and the version marker of its logs in one statement:
+    # creating a log changes the count, editing one the latest edited_at
+    logs = models.Coaching_logs
+    result = await db.execute(
+        select(
+            models.Clients.coach_username,
+            select(func.max(logs.edited_at))
+            .filter(logs.client_id == client_id)
+            .scalar_subquery()
+            .label("edited_at"),
+            select(func.count())
+            .filter(logs.client_id == client_id)
+            .scalar_subquery()
+            .label("logs"),
+        ).filter(models.Clients.id == client_id)
+    )
+    client = result.first()
     if client and (
         client.coach_username == current_user.username or current_user.role == "admin"
     ):
-        coaching_logs = []
-        for coaching_log in client.coaching_logs_list:
-            coaching_logs.append(coaching_log.__dict__)
-        return coaching_logs
+        # the query string picks the page and fields
+        etag = make_etag(client.edited_at, client.logs, str(request.query_params))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        query = (
+            select(*coaching_log_columns(fields))
+            .filter_by(client_id=client_id)
+            .order_by(models.Coaching_logs.created_at, models.Coaching_logs.id)
+        )
+        if after is not None:
+            try:
+                created_at, log_id = decode_cursor(after)
+                created_at = datetime.fromisoformat(created_at)
+                if not isinstance(log_id, int):
+                    raise ValueError("Invalid cursor")
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            # typed literal, asyncpg can't infer the timezone-aware type in a tuple
+            created_at = literal(created_at, models.Coaching_logs.created_at.type)
+            query = query.filter(
+                tuple_(models.Coaching_logs.created_at, models.Coaching_logs.id)
+                > tuple_(created_at, log_id)
+            )
+        if since is not None:
+            query = query.filter(models.Coaching_logs.edited_at >= since)
+        if limit != -1:
+            query = query.limit(limit)
+
+        coaching_logs = [
+            coaching_log_row(row) for row in (await db.execute(query)).mappings()
+        ]
+        response = TrustedJSONResponse(coaching_logs)
+        set_etag(response, etag)
+        if coaching_logs and len(coaching_logs) == limit:
+            last_log = coaching_logs[-1]
+            response.headers["X-Next-Cursor"] = encode_cursor(
+                last_log["created_at"].isoformat(), last_log["id"]
+            )
+        return response
     else:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -79,41 +271,188 @@ async def list_all_coaching_logs(
         )
 
 
+@router.get("/batch", response_model=Dict[int, List[CoachingLog]])
+async def list_coaching_logs_of_clients(
+    client_id: List[int] = Query(...),
+    since: Optional[datetime] = None,
+    fields: Literal["all", "metadata"] = "all",
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+) -> dict[int, list[CoachingLog]]:
+    """List the coaching_logs of many clients at once (`client_id` repeated), grouped
+    by client and ordered by created_at. The current_user must be the coach of every
+    client, or admin. `since` and `fields` work as in /list/{client_id}.
+    """
+
+    client_ids = set(client_id)
+    if len(client_ids) > MAX_BATCH_CLIENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_CLIENTS} clients per request",
+        )
+
+    query = select(models.Clients.id).filter(models.Clients.id.in_(client_ids))
+    if current_user.role != "admin":
+        query = query.filter_by(coach_username=current_user.username)
+    accessible = set((await db.execute(query)).scalars().all())
+    if accessible != client_ids:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Unauthorized access",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    query = (
+        select(models.Coaching_logs.client_id, *coaching_log_columns(fields))
+        .filter(models.Coaching_logs.client_id.in_(client_ids))
+        .order_by(
+            models.Coaching_logs.client_id,
+            models.Coaching_logs.created_at,
+            models.Coaching_logs.id,
+        )
+    )
+    if since is not None:
+        query = query.filter(models.Coaching_logs.edited_at >= since)
+
+    coaching_logs = {client_id: [] for client_id in sorted(client_ids)}
+    for row in (await db.execute(query)).mappings():
+        coaching_log = coaching_log_row(row)
+        coaching_logs[coaching_log.pop("client_id")].append(coaching_log)
+    return TrustedJSONResponse(coaching_logs)
+
+
+@router.get("/search", response_model=List[SearchResult])
+async def search_coaching_logs(
+    q: str,
+    client_id: Optional[int] = None,
+    limit: int = 20,
+    skip: int = 0,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+) -> list[SearchResult]:
+    """Full-text search of the coaching log answers, best matches first. `q` takes
+    web search syntax ("quoted phrases", or, -exclude). Coaches search their clients'
+    logs, admin searches all. Page with `limit` and `skip`.
+    """
+
+    if db.bind.dialect.name != "postgresql":
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Search needs PostgreSQL",
+        )
+    check_page_limit(limit, MAX_SEARCH_LIMIT)
+
+    logs = models.Coaching_logs
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    rank = func.ts_rank_cd(logs.search_vector, query)
+    matches = (
+        select(
+            logs.id,
+            logs.client_id,
+            logs.created_by,
+            logs.created_at,
+            logs.data,
+            rank.label("rank"),
+        )
+        .filter(logs.search_vector.op("@@")(query))
+        .order_by(rank.desc(), logs.id.desc())
+        .limit(limit)
+        .offset(skip)
+    )
+    if current_user.role != "admin":
+        matches = matches.join(models.Clients).filter(
+            models.Clients.coach_username == current_user.username
+        )
+    if client_id is not None:
+        matches = matches.filter(logs.client_id == client_id)
+    matches = matches.subquery()
+
+    # snippets are costly, only make them for the page
+    result = await db.execute(
+        select(
+            matches.c.id,
+            matches.c.client_id,
+            matches.c.created_by,
+            matches.c.created_at,
+            matches.c.rank,
+            func.ts_headline(
+                SEARCH_CONFIG,
+                func.coaching_log_answers(matches.c.data),
+                query,
+                SEARCH_HEADLINE_OPTIONS,
+            ).label("snippet"),
+        ).order_by(matches.c.rank.desc(), matches.c.id.desc())
+    )
+    return TrustedJSONResponse([dict(row) for row in result.mappings()])
+
+
 @router.post("/create/{client_id}", response_model=Message)
 async def create_coaching_log(
-    client_id: str,
+    client_id: int,
     coaching_log_data: dict,
+    response: Response,
+    version: str = CURRENT_COACHING_LOG_VERSION,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> dict[str, str]:
     """Create a new coaching log for this client_id, and lock the last coaching log.
     Then, create a new coaching_log_reimbursement for this coaching log.
-    Admin cannot create coaching log for clients.
+    Admin cannot create coaching log for clients. Data of an older `version` is
+    upgraded to the current one. The ETag header is the new log's, for edits.
     """
 
-    client = db.query(models.Clients).filter_by(id=client_id).first()
+    coaching_log_data = current_version_data(version, coaching_log_data)
+    # locking the client serializes concurrent creates for the same client
+    result = await db.execute(
+        select(models.Clients.coach_username).filter_by(id=client_id).with_for_update()
+    )
+    client = result.first()
     if client and client.coach_username == current_user.username:
+        last_coaching_log = await get_latest_coaching_log(
+            db,
+            client_id,
+            load_options=[
+                defer(models.Coaching_logs.data),
+                defer(models.Coaching_logs.data_jsonb),
+            ],
+        )
         new_coaching_log = models.Coaching_logs(
             client_id=client_id,
             version=CURRENT_COACHING_LOG_VERSION,
             data=coaching_log_data,
+            data_jsonb=coaching_log_data,
             created_by=current_user.username,
             edited_by=current_user.username,
         )
         db.add(new_coaching_log)
 
-        if len(client.coaching_logs_list) != 0:
-            last_coaching_log = client.coaching_logs_list[-1]
+        unlocked_logs = 1  # the new log
+        previous_coach = None  # creator of the last log, if it gets locked now
+        if last_coaching_log is not None:
+            if not last_coaching_log.locked:
+                if last_coaching_log.created_by == current_user.username:
+                    unlocked_logs = 0
+                else:
+                    previous_coach = last_coaching_log.created_by
             last_coaching_log.locked = True
-        db.flush()  # get new coaching_log_id
+        await db.flush()  # get new coaching_log_id
+        await record_revision(db, new_coaching_log.id, new_coaching_log.row_version)
+        # after the flush, a summary counted afresh already sees the changes
+        await update_coach_summary(db, previous_coach, unlocked_logs=-1)
+        await update_coach_summary(
+            db, current_user.username, unlocked_logs=unlocked_logs, sessions=1
+        )
 
         new_reimbursement = models.Coaching_log_reimbursement(
             coaching_log_id=new_coaching_log.id,
             reimbursed_to=current_user.username,
         )
         db.add(new_reimbursement)
-        db.commit()
+        await db.commit()
 
+        response.headers["ETag"] = coaching_log_etag(
+            new_coaching_log.id, new_coaching_log.row_version
+        )
         return {"message": "Successfully created coaching log"}
     else:
         raise HTTPException(
@@ -125,25 +464,56 @@ async def create_coaching_log(
 
 @router.put("/edit/{client_id}", response_model=Message)
 async def edit_coaching_log(
-    client_id: str,
+    client_id: int,
     coaching_log_data: dict,
+    request: Request,
+    response: Response,
+    version: str = CURRENT_COACHING_LOG_VERSION,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> dict[str, str]:
-    """Edit the last coaching log if it is not locked. Admin cannot edit coaching log for clients."""
+    """Edit the last coaching log if it is not locked. Admin cannot edit coaching log for clients.
+    Data of an older `version` is upgraded to the current one. With If-Match, a log
+    edited since gets 409 instead of being overwritten (see patch_coaching_log).
+    """
 
-    client = db.query(models.Clients).filter_by(id=client_id).first()
+    coaching_log_data = current_version_data(version, coaching_log_data)
+    result = await db.execute(
+        select(models.Clients.coach_username).filter_by(id=client_id)
+    )
+    client = result.first()
     if client and client.coach_username == current_user.username:
-        if len(client.coaching_logs_list) != 0:
-            last_coaching_log = client.coaching_logs_list[-1]
+        last_coaching_log = await get_latest_coaching_log(
+            db,
+            client_id,
+            load_options=[
+                defer(models.Coaching_logs.data),
+                defer(models.Coaching_logs.data_jsonb),
+            ],
+        )
+        if last_coaching_log is not None:
             if not last_coaching_log.locked:
-                last_coaching_log.version = (
-                    CURRENT_COACHING_LOG_VERSION  # forcely update new edit to current version
-                )
+                if "if-match" in request.headers:
+                    check_if_match(request, last_coaching_log)
+                old_data = await get_coaching_log_data(db, last_coaching_log.id)
+                last_coaching_log.version = CURRENT_COACHING_LOG_VERSION
                 last_coaching_log.data = coaching_log_data
+                last_coaching_log.data_jsonb = coaching_log_data
                 last_coaching_log.edited_by = current_user.username
                 last_coaching_log.edited_at = datetime.now(timezone.utc)
-                db.commit()
+                last_coaching_log.row_version += 1
+                await record_revision(
+                    db,
+                    last_coaching_log.id,
+                    last_coaching_log.row_version,
+                    diff_data(old_data, coaching_log_data),
+                    current_user.username,
+                    last_coaching_log.edited_at,
+                )
+                await db.commit()
+                response.headers["ETag"] = coaching_log_etag(
+                    last_coaching_log.id, last_coaching_log.row_version
+                )
                 return {"message": "Successfully edited coaching log"}
             else:
                 raise HTTPException(
@@ -163,3 +533,177 @@ async def edit_coaching_log(
             detail="Unauthorized access",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+
+@router.patch("/edit/{client_id}", response_model=Message)
+async def patch_coaching_log(
+    client_id: int,
+    patch: dict,
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+) -> dict[str, str]:
+    """Edit the last coaching log with a JSON merge patch of its data, if it is not
+    locked: only the answers that changed, null removes one. If-Match must hold the
+    log's ETag, from the create or a previous edit. A log edited since gets 409 with
+    its current ETag. Admin cannot edit coaching log for clients.
+    """
+
+    if "if-match" not in request.headers:
+        raise HTTPException(status_code=428, detail="If-Match required")
+
+    result = await db.execute(
+        select(models.Clients.coach_username).filter_by(id=client_id)
+    )
+    client = result.first()
+    if client and client.coach_username == current_user.username:
+        last_coaching_log = await get_latest_coaching_log(
+            db,
+            client_id,
+            load_options=[
+                defer(models.Coaching_logs.data),
+                defer(models.Coaching_logs.data_jsonb),
+            ],
+        )
+        if last_coaching_log is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Coaching log not found",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        if last_coaching_log.locked:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Accessing locked files",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        check_if_match(request, last_coaching_log)
+        if not can_upgrade(last_coaching_log.version):
+            # its data is served as stored, merging into it can't make it current
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown coaching log version: {last_coaching_log.version}",
+            )
+
+        logs = models.Coaching_logs
+        if (
+            db.bind.dialect.name == "postgresql"
+            and last_coaching_log.version == CURRENT_COACHING_LOG_VERSION
+            and not any(isinstance(value, dict) for value in patch.values())
+        ):
+            # a flat patch of current data is applied in the database without
+            # reading the log's data, and the patch itself is the revision's diff
+            data = func.coalesce(logs.data_jsonb, cast(logs.data, JSONB))
+            diff = {}
+            removed = [key for key, value in patch.items() if value is None]
+            if removed:
+                data = data.op("-")(cast(array(removed), ARRAY(Text)))
+                diff["unset"] = removed
+            changed = {key: value for key, value in patch.items() if value is not None}
+            if changed:
+                data = data.op("||")(cast(changed, JSONB))
+                diff["set"] = changed
+            values = {"data_jsonb": data, "data": cast(data, JSON)}
+        else:
+            old_data = await get_coaching_log_data(db, last_coaching_log.id)
+            data = merge_patch(old_data, patch)
+            diff = diff_data(old_data, data)
+            values = {"data_jsonb": data, "data": data}
+
+        row_version = last_coaching_log.row_version + 1
+        edited_at = datetime.now(timezone.utc)
+        await db.execute(
+            update(logs)
+            .where(logs.id == last_coaching_log.id)
+            .values(
+                version=CURRENT_COACHING_LOG_VERSION,
+                edited_by=current_user.username,
+                edited_at=edited_at,
+                row_version=logs.row_version + 1,
+                **values,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await record_revision(
+            db,
+            last_coaching_log.id,
+            row_version,
+            diff,
+            current_user.username,
+            edited_at,
+        )
+        await db.commit()
+        response.headers["ETag"] = coaching_log_etag(last_coaching_log.id, row_version)
+        return {"message": "Successfully edited coaching log"}
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Unauthorized access",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+async def check_coaching_log_access(
+    db: AsyncSession, coaching_log_id: int, current_user: User
+) -> None:
+    """403 unless the current_user is the coach of the log's client, or admin"""
+
+    result = await db.execute(
+        select(models.Clients.coach_username)
+        .join(models.Coaching_logs)
+        .filter(models.Coaching_logs.id == coaching_log_id)
+    )
+    client = result.first()
+    if not client or (
+        client.coach_username != current_user.username and current_user.role != "admin"
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Unauthorized access",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@router.get("/revisions/{coaching_log_id}", response_model=List[Revision])
+async def list_coaching_log_revisions(
+    coaching_log_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+) -> list[Revision]:
+    """List the revisions of a coaching log, oldest first, if the current_user is
+    the coach of its client or admin. Logs edited before revisions were recorded
+    start their history at their first edit since.
+    """
+
+    await check_coaching_log_access(db, coaching_log_id, current_user)
+    result = await db.execute(
+        select(*model_columns(Revision, models.Coaching_log_revisions))
+        .filter_by(coaching_log_id=coaching_log_id)
+        .order_by(models.Coaching_log_revisions.revision)
+    )
+    return TrustedJSONResponse([dict(row) for row in result.mappings()])
+
+
+@router.get(
+    "/revisions/{coaching_log_id}/{revision}", response_model=CoachingLogRevision
+)
+async def get_coaching_log_revision(
+    coaching_log_id: int,
+    revision: int,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+) -> CoachingLogRevision:
+    """The data of a coaching log as of one of its revisions, if the current_user is
+    the coach of its client or admin
+    """
+
+    await check_coaching_log_access(db, coaching_log_id, current_user)
+    coaching_log_revision = await get_revision(db, coaching_log_id, revision)
+    if coaching_log_revision is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Revision not found",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return TrustedJSONResponse(coaching_log_revision)
@@ -0,0 +1,156 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from app.api.auth import User, get_current_active_user, verify_is_admin
+
+from datetime import date, datetime, timezone
+from typing import Iterable, Optional
+from pydantic import BaseModel
+
+from sqlalchemy import Date, case, false, func, literal, select, true, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.api import models
+
+router = APIRouter()
+
+
+class DashboardSummary(BaseModel):
+    coach_username: str
+    clients: int
+    sessions_this_month: int
+    unlocked_logs: int
+
+
+def current_month() -> date:
+    return datetime.now(timezone.utc).date().replace(day=1)
+
+
+async def refresh_coach_summaries(
+    db: AsyncSession, coaches: Optional[Iterable[str]] = None
+) -> None:
+    """Recount the summaries of `coaches` (default everyone) from the base tables
+    and upsert them, in the caller's transaction
+    """
+
+    await db.flush()  # the counts must see the caller's pending changes
+    month = current_month()
+    month_start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    users, logs = models.Users, models.Coaching_logs
+    query = select(
+        users.username,
+        select(func.count())
+        .where(models.Clients.coach_username == users.username)
+        .scalar_subquery(),
+        select(func.count())
+        .where(logs.created_by == users.username, logs.locked == false())
+        .scalar_subquery(),
+        literal(month, Date),
+        select(func.count())
+        .where(logs.created_by == users.username, logs.created_at >= month_start)
+        .scalar_subquery(),
+    ).where(true() if coaches is None else users.username.in_(list(coaches)))
+
+    summary = models.Coach_summary.__table__
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    columns = [
+        "coach_username",
+        "clients",
+        "unlocked_logs",
+        "sessions_month",
+        "sessions",
+    ]
+    statement = dialect.insert(summary).from_select(columns, query)
+    statement = statement.on_conflict_do_update(
+        index_elements=[summary.c.coach_username],
+        set_={
+            **{column: statement.excluded[column] for column in columns[1:]},
+            "updated_at": func.now(),
+        },
+    )
+    await db.execute(statement)
+
+
+async def update_coach_summary(
+    db: AsyncSession,
+    coach_username: Optional[str],
+    clients: int = 0,
+    unlocked_logs: int = 0,
+    sessions: int = 0,
+) -> None:
+    """Add these changes to the coach's summary, in the caller's transaction. Call it
+    after making the changes: a coach without a summary yet gets one counted from the
+    base tables instead, which must already include them.
+    """
+
+    if coach_username is None:
+        return
+    summary = models.Coach_summary
+    month = current_month()
+    result = await db.execute(
+        update(summary)
+        .filter_by(coach_username=coach_username)
+        .values(
+            clients=summary.clients + clients,
+            unlocked_logs=summary.unlocked_logs + unlocked_logs,
+            # a new month starts counting from zero
+            sessions=case(
+                (summary.sessions_month == month, summary.sessions + sessions),
+                else_=sessions,
+            ),
+            sessions_month=month,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        await refresh_coach_summaries(db, [coach_username])
+
+
+@router.get("", response_model=DashboardSummary)
+async def get_dashboard(
+    coach_username: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+) -> DashboardSummary:
+    """Clients, sessions this month and unlocked coaching logs of the current user.
+    Admin may pass another `coach_username`.
+    """
+
+    if coach_username is None:
+        coach_username = current_user.username
+    elif coach_username != current_user.username and current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Unauthorized access",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    summary = await db.get(models.Coach_summary, coach_username)
+    if summary is None:
+        await refresh_coach_summaries(db, [coach_username])
+        await db.commit()
+        summary = await db.get(models.Coach_summary, coach_username)
+        if summary is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Username not found",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+    return {
+        "coach_username": summary.coach_username,
+        "clients": summary.clients,
+        "sessions_this_month": (
+            summary.sessions if summary.sessions_month == current_month() else 0
+        ),
+        "unlocked_logs": summary.unlocked_logs,
+    }
+
+
+### ---------- admin right ----------
+@router.post("/rebuild", dependencies=[Depends(verify_is_admin)])
+async def rebuild_dashboard(db: AsyncSession = Depends(get_db)) -> dict[str, str]:
+    """Recount every coach's summary from the base tables. Only admin can access"""
+
+    await refresh_coach_summaries(db)
+    await db.commit()
+    return {"message": "Successfully rebuilt dashboard summaries"}
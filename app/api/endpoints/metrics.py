@@ -0,0 +1,47 @@
+import os
+import secrets
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from app.database import async_engine
+from app.hashing import hasher
+
+router = APIRouter()
+
+# static credential of the scraper, unset serves no metrics at all
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+
+async def verify_metrics_token(request: Request) -> None:
+    """Check the `Authorization: Bearer <METRICS_TOKEN>` header of a scraper"""
+
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if (
+        not METRICS_TOKEN
+        or scheme.lower() != "bearer"
+        or not secrets.compare_digest(token.encode(), METRICS_TOKEN.encode())
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@router.get("", response_class=Response, dependencies=[Depends(verify_metrics_token)])
+async def prometheus_metrics() -> Response:
+    """Metrics in the Prometheus text format, for scraping with METRICS_TOKEN"""
+
+    # set as a header, media_type would get a second charset appended
+    return Response(generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+@router.get("/pool", dependencies=[Depends(verify_metrics_token)])
+async def pool_metrics() -> dict[str, dict]:
+    """Database connection pool and password hashing pool usage"""
+
+    return {
+        "database": async_engine.pool.stats(),
+        "password_hashing": hasher.stats(),
+    }
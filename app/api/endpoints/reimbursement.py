@@ -0,0 +1,183 @@
+from fastapi import APIRouter, Depends, Response
+from app.api.auth import User, get_current_active_user, verify_is_admin
+
+from datetime import date, datetime
+from typing import List, Optional
+from pydantic import BaseModel, root_validator
+
+from sqlalchemy import false, func, select, true, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.api import models
+from app.util import check_page_limit
+
+router = APIRouter()
+
+BATCH_SIZE = 1000  # ids per UPDATE
+MAX_PAGE_SIZE = 1000
+
+
+class Reimbursement(BaseModel):
+    id: int
+    coaching_log_id: int
+    client_id: int
+    reimbursed_to: str
+    session_date: datetime  # the coaching log's created_at
+
+
+class MarkReimbursed(BaseModel):
+    """Either reimbursement `ids`, or every outstanding one of `coach_username`"""
+
+    ids: Optional[List[int]]
+    coach_username: Optional[str]
+    reimbursed_via: str
+
+    @root_validator
+    def one_selection(cls, values):
+        if (values.get("ids") is None) == (values.get("coach_username") is None):
+            raise ValueError("give either ids or coach_username")
+        return values
+
+
+class MonthlyTotal(BaseModel):
+    coach_username: str
+    month: str  # YYYY-MM of the session
+    sessions: int
+    reimbursed: int
+    outstanding: int
+
+
+def scope_to_coach(query, current_user: User, coach_username: Optional[str]):
+    """Admin may look at any coach (or all of them), coaches only at themselves"""
+
+    if current_user.role != "admin":
+        coach_username = current_user.username
+    if coach_username is not None:
+        query = query.filter(
+            models.Coaching_log_reimbursement.reimbursed_to == coach_username
+        )
+    return query
+
+
+@router.get("/outstanding", response_model=List[Reimbursement])
+async def list_outstanding_reimbursements(
+    response: Response,
+    coach_username: Optional[str] = None,
+    limit: int = 100,
+    after: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+) -> list[Reimbursement]:
+    """list the sessions not reimbursed yet, oldest first. Coaches get their own,
+    admin gets `coach_username`'s or everyone's. Pass the X-Next-Cursor header of a
+    page as `after` to get the next one
+    """
+
+    check_page_limit(limit, MAX_PAGE_SIZE)
+    reimbursement = models.Coaching_log_reimbursement
+    query = (
+        select(
+            reimbursement.id,
+            reimbursement.coaching_log_id,
+            models.Coaching_logs.client_id,
+            reimbursement.reimbursed_to,
+            models.Coaching_logs.created_at.label("session_date"),
+        )
+        .join(
+            models.Coaching_logs,
+            models.Coaching_logs.id == reimbursement.coaching_log_id,
+        )
+        .filter(reimbursement.reimbursed == false())
+        .order_by(reimbursement.id)
+        .limit(limit)
+    )
+    query = scope_to_coach(query, current_user, coach_username)
+    if after is not None:
+        query = query.filter(reimbursement.id > after)
+
+    rows = (await db.execute(query)).mappings().all()
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return rows
+
+
+### ---------- admin right ----------
+@router.post("/mark-reimbursed", dependencies=[Depends(verify_is_admin)])
+async def mark_reimbursed(
+    selection: MarkReimbursed,
+    db: AsyncSession = Depends(get_db),
+) -> dict[str, int]:
+    """mark outstanding reimbursements as paid via `reimbursed_via`, in one
+    transaction. Already reimbursed ones are left as they are. Only admin can access
+    """
+
+    reimbursement = models.Coaching_log_reimbursement
+    mark = (
+        update(reimbursement)
+        .filter(reimbursement.reimbursed == false())
+        .values(
+            reimbursed=true(),
+            reimbursed_at=func.now(),
+            reimbursed_via=selection.reimbursed_via,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    if selection.ids is None:
+        statements = [mark.filter_by(reimbursed_to=selection.coach_username)]
+    else:
+        statements = [
+            mark.filter(reimbursement.id.in_(selection.ids[start : start + BATCH_SIZE]))
+            for start in range(0, len(selection.ids), BATCH_SIZE)
+        ]
+    updated = 0
+    for statement in statements:
+        updated += (await db.execute(statement)).rowcount
+    await db.commit()
+    return {"updated": updated}
+
+
+@router.get("/monthly-totals", response_model=List[MonthlyTotal])
+async def monthly_reimbursement_totals(
+    coach_username: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+) -> list[MonthlyTotal]:
+    """sessions per coach and month, split into reimbursed and outstanding, for the
+    sessions in [since, until). Coaches get their own, admin gets `coach_username`'s
+    or everyone's
+    """
+
+    reimbursement = models.Coaching_log_reimbursement
+    session_date = models.Coaching_logs.created_at
+    if db.bind.dialect.name == "postgresql":
+        month = func.to_char(session_date, "YYYY-MM")
+    else:
+        month = func.strftime("%Y-%m", session_date)
+    month = month.label("month")
+    reimbursed = reimbursement.reimbursed == true()
+
+    query = (
+        select(
+            reimbursement.reimbursed_to.label("coach_username"),
+            month,
+            func.count().label("sessions"),
+            func.count().filter(reimbursed).label("reimbursed"),
+            func.count().filter(~reimbursed).label("outstanding"),
+        )
+        .join(
+            models.Coaching_logs,
+            models.Coaching_logs.id == reimbursement.coaching_log_id,
+        )
+        .group_by("coach_username", "month")  # by label, the month format is a bind
+        .order_by("coach_username", "month")
+    )
+    query = scope_to_coach(query, current_user, coach_username)
+    if since is not None:
+        query = query.filter(session_date >= since)
+    if until is not None:
+        query = query.filter(session_date < until)
+
+    return (await db.execute(query)).mappings().all()
@@ -1,42 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Form, Response, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.auth import (
     User,
+    UserInDB,
     get_current_active_user,
     get_password_hash,
     authenticate_user,
+    invalidate_user,
+    set_access_token_cookie,
+    token_revocations,
 )
-from app.database import SessionLocal
+from app.database import get_db
 from app.api import models
 
 router = APIRouter()
 
 
-# Dependency
-def get_db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
-
-
 @router.post("/change-password")
 async def change_password(
+    response: Response,
     current_password: str = Form(...),
     new_password: str = Form(...),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> dict[str, str]:
-    """Change password for current user if the current password is correct"""
+    """Change password for current user if the current password is correct.
+    Tokens issued before the change are revoked, this session gets a new one.
+    """
 
-    user_in_db = authenticate_user(current_user.username, current_password)
+    user_in_db = await authenticate_user(db, current_user.username, current_password)
     if user_in_db:
-        hashed_new_password = get_password_hash(new_password)
-        user = db.query(models.Users).filter_by(username=current_user.username).first()
+        hashed_new_password = await get_password_hash(new_password)
+        result = await db.execute(
+            select(models.Users).filter_by(username=current_user.username)
+        )
+        user = result.scalars().first()
         user.hashed_password = hashed_new_password
-        db.commit()
+        user.token_version += 1
+        await db.commit()
+        await invalidate_user(current_user.username)
+        await token_revocations.revoke_versions_below(
+            current_user.username, user.token_version
+        )
+        set_access_token_cookie(response, UserInDB(**dict(user.__dict__)))
     else:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
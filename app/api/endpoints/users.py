@@ -2,7 +2,10 @@ import uuid
 from typing import Optional, List
 from pydantic import BaseModel
 from fastapi import APIRouter, Depends, HTTPException, Form
-from sqlalchemy.orm import Session, joinedload
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from app.api.auth import (
     get_current_active_user,
@@ -10,9 +13,16 @@ from app.api.auth import (
     verify_is_admin,
     User,
 )
-from app.database import SessionLocal
+from app.database import get_db
 from app.api import models
-from app.util import convert_db_list_to_py_list
+from app.util import (
+    STREAM_BATCH_SIZE,
+    TrustedJSONResponse,
+    check_page_limit,
+    json_dumps,
+    model_dict,
+    stream_ndjson,
+)
 from .clients import ClientName
 
 
@@ -26,16 +36,17 @@ class UserDetails(BaseModel):
     clients_list: Optional[List[ClientName]]
 
 
-# Dependency
-def get_db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally:
-        db.close()
+router = APIRouter()
+
 
+def user_to_dict(user: models.Users) -> dict:
+    """User's UserDetails fields and its clients_list as dicts"""
 
-router = APIRouter()
+    user_dict = model_dict(UserDetails, user, exclude=["clients_list"])
+    user_dict["clients_list"] = [
+        model_dict(ClientName, client) for client in user.clients_list
+    ]
+    return user_dict
 
 
 ### ---------- admin right ----------
@@ -46,16 +57,19 @@ async def create_user(
     first_name: str = Form(...),
     last_name: str = Form(...),
     role: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ) -> dict[str, str]:
     """Create a new user with random password"""
 
-    if db.query(models.Users).filter_by(username=username).first() is not None:
+    result = await db.execute(
+        select(models.Users.username).filter_by(username=username)
+    )
+    if result.first() is not None:
         raise HTTPException(status_code=409, detail="Username exists")
 
     random_password = str(uuid.uuid4())[-8:]
-    hashed_password = get_password_hash(random_password)
+    hashed_password = await get_password_hash(random_password)
 
     new_user = models.Users(
         username=username,
@@ -68,7 +82,7 @@ async def create_user(
     )
 
     db.add(new_user)
-    db.commit()
+    await db.commit()
 
     return {"password": random_password}
 
@@ -79,23 +93,45 @@ async def create_user(
     response_model=List[UserDetails],
 )
 async def list_all_users(
-    limit: int = -1, skip: int = 0, db: Session = Depends(get_db)
+    limit: int = -1,
+    skip: int = 0,
+    after: Optional[str] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(get_db),
 ) -> list[UserDetails]:
-    """Return the list of all users if the curernt user is admin"""
-
-    if limit == -1:  # temporary fix for query the whole table
-        users_list = (
-            db.query(models.Users)
-            .options(joinedload("clients_list"))
-            .order_by(models.Users.username)
-            .all()
+    """Return the list of all users if the curernt user is admin.
+    Pages are keyed on username: pass the X-Next-Cursor header of a page as `after`
+    to get the next one. `stream` returns NDJSON read from a server-side cursor.
+    """
+
+    check_page_limit(limit)
+    # clients_list can't be lazy loaded in async, so load it with the users
+    query = (
+        select(models.Users)
+        .options(
+            selectinload(models.Users.clients_list).load_only(
+                *(getattr(models.Clients, name) for name in ClientName.__fields__)
+            )
+        )
+        .order_by(models.Users.username)
+    )
+    if after is not None:
+        query = query.filter(models.Users.username > after)
+    if limit != -1:  # -1 is a temporary fix to query the whole table
+        query = query.limit(limit).offset(skip)
+
+    if stream:
+        # selectinload runs once per batch of yield_per users
+        result = await db.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        return StreamingResponse(
+            stream_ndjson(
+                result.scalars(), lambda user: json_dumps(user_to_dict(user))
+            ),
+            media_type="application/x-ndjson",
         )
-    else:
-        users_list = db.query(models.Users).limit(limit).offset(skip)
-    users = []
-    for user in users_list:
-        clients_list = convert_db_list_to_py_list(user.clients_list)
-        user_dict = user.__dict__
-        user_dict["clients_list"] = clients_list
-        users.append(user.__dict__)
-    return users
+
+    users = [user_to_dict(user) for user in (await db.execute(query)).scalars()]
+    response = TrustedJSONResponse(users)
+    if users and len(users) == limit:
+        response.headers["X-Next-Cursor"] = users[-1]["username"]
+    return response
@@ -1,10 +1,11 @@
-from sqlalchemy import Column, ForeignKey
+from sqlalchemy import DDL, Column, ForeignKey, Index, event
 from sqlalchemy import Text, Integer, String, Boolean
-from sqlalchemy.sql import func
-from sqlalchemy.types import TIMESTAMP
-from sqlalchemy.schema import Identity, CreateTable
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import ARRAY, JSON
+from sqlalchemy import JSON as GenericJSON
+from sqlalchemy.sql import func, literal_column
+from sqlalchemy.types import TIMESTAMP, Date
+from sqlalchemy.schema import Identity, CreateTable, Sequence
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.dialects.postgresql import ARRAY, JSON, JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from app.database import engine
 
@@ -28,6 +29,8 @@ class Users(Base):
     email = Column(String(255))
     role = Column(String(255))
     disabled = Column(Boolean, default=False)
+    # bumped to revoke every token issued to the user, e.g. on password change
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_by = Column(String(255), ForeignKey("users.username"))
     created_at = Column(TIMESTAMP(timezone=True), default=func.now())
     clients_list = relationship(
@@ -37,6 +40,29 @@ class Users(Base):
     )
 
 
+# position in the client id permutation, see allocate_client_ids (postgres only)
+client_id_seq = Sequence(
+    "client_id_seq", start=0, minvalue=0, maxvalue=999999, metadata=Base.metadata
+)
+
+
+def client_search_text(first_name, last_name, email, mobile_phone):
+    """What client typeahead search matches against, lower case. Literals are inlined
+    so that queries repeat the pg_trgm index expression exactly.
+    """
+
+    empty, space = literal_column("''"), literal_column("' '")
+    return func.lower(
+        func.coalesce(first_name, empty)
+        + space
+        + func.coalesce(last_name, empty)
+        + space
+        + func.coalesce(email, empty)
+        + space
+        + func.coalesce(mobile_phone, empty)
+    )
+
+
 class Clients(Base):
     __tablename__ = "clients"
     id = Column(Integer, primary_key=True, autoincrement=False)
@@ -51,22 +77,154 @@ class Clients(Base):
     disabled = Column(Boolean, default=False)
     created_by = Column(String(255), ForeignKey("users.username"))
     created_at = Column(TIMESTAMP(timezone=True), default=func.now())
+    # changes on every update, for the ETags of client reads
+    updated_at = Column(
+        TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
     coaching_logs_list = relationship(
         "Coaching_logs", order_by="Coaching_logs.created_at"
     )
 
+    __table_args__ = (
+        # version marker of a coach's client list: max(updated_at) and count
+        Index("ix_clients_coach_username_updated_at", "coach_username", "updated_at"),
+        Index(
+            "ix_clients_search_text_trgm",
+            client_search_text(first_name, last_name, email, mobile_phone).label(
+                "search_text"
+            ),
+            postgresql_using="gin",
+            postgresql_ops={"search_text": "gin_trgm_ops"},
+        ),
+    )
+
+
+# free text answers of a coaching log's data, the ones full-text search covers
+COACHING_LOG_ANSWER_FIELDS = [
+    "ansQ1Introduction",
+    "ansQ2Dermatology",
+    "ansQ3Pharmacology",
+    "ansQ4Nutrition",
+    "ansQ5Stress",
+    "ansQ6Sleep",
+    "ansQ7Exercise",
+    "ansQ8Environment",
+    "ansQ9Others",
+]
+
+
+PG_TRGM_SQL = "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+event.listen(
+    Clients.__table__,
+    "before_create",
+    DDL(PG_TRGM_SQL).execute_if(dialect="postgresql"),
+)
+# the same expression as the index, so queries can use it
+clients_search_text = client_search_text(
+    Clients.first_name, Clients.last_name, Clients.email, Clients.mobile_phone
+)
+
 
 class Coaching_logs(Base):
     __tablename__ = "coaching_logs"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    client_id = Column(Integer, ForeignKey("clients.id"), index=True)
+    # indexed by the composite indexes below, which start with it
+    client_id = Column(Integer, ForeignKey("clients.id"))
     version = Column(String(255))
     data = Column(JSON)
+    # data at the current version, filled by migrate_coaching_logs in app.migrations.
+    # Writes keep data too until every reader has moved over
+    data_jsonb = Column(
+        JSONB(none_as_null=True).with_variant(GenericJSON(none_as_null=True), "sqlite")
+    )
     locked = Column(Boolean, default=False)
-    created_by = Column(String(255), ForeignKey("users.username"), index=True)
+    created_by = Column(String(255), ForeignKey("users.username"))  # likewise
     created_at = Column(TIMESTAMP(timezone=True), default=func.now())
     edited_by = Column(String(255), ForeignKey("users.username"), index=True)
     edited_at = Column(TIMESTAMP(timezone=True), default=func.now())
+    # bumped on every edit, for the If-Match of concurrent editors
+    row_version = Column(Integer, nullable=False, default=1, server_default="1")
+    # maintained by a trigger on postgres, see coaching_logs_search_ddl
+    search_vector = deferred(Column(TSVECTOR().with_variant(Text, "sqlite")))
+
+    __table_args__ = (
+        # a client's logs in order, for paging and for finding the latest log
+        Index("ix_coaching_logs_client_id_created_at", "client_id", "created_at"),
+        # version marker of a client's logs: max(edited_at) and count
+        Index("ix_coaching_logs_client_id_edited_at", "client_id", "edited_at"),
+        # sessions in a date range, for the monthly reimbursement totals
+        Index("ix_coaching_logs_created_at_id", "created_at", "id"),
+        # a coach's unlocked logs and sessions this month, for rebuilding summaries
+        Index("ix_coaching_logs_created_by_locked", "created_by", "locked"),
+        Index("ix_coaching_logs_created_by_created_at", "created_by", "created_at"),
+        Index(
+            "ix_coaching_logs_search_vector", "search_vector", postgresql_using="gin"
+        ),
+        # containment (@>) queries on the data
+        Index(
+            "ix_coaching_logs_data_jsonb",
+            "data_jsonb",
+            postgresql_using="gin",
+            postgresql_ops={"data_jsonb": "jsonb_path_ops"},
+        ),
+    )
+
+
+# coaching_log_answers(data) is the searched text, also used for the snippets
+ANSWERS_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION coaching_log_answers(data json) RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT concat_ws(' ', %s)
+$$
+""" % ", ".join(f"data->>'{field}'" for field in COACHING_LOG_ANSWER_FIELDS)
+SEARCH_VECTOR_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION coaching_logs_search_vector_update() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('english', coaching_log_answers(NEW.data));
+    RETURN NEW;
+END
+$$
+"""
+SEARCH_VECTOR_TRIGGER_SQL = """
+CREATE TRIGGER coaching_logs_search_vector
+BEFORE INSERT OR UPDATE OF data ON coaching_logs
+FOR EACH ROW EXECUTE FUNCTION coaching_logs_search_vector_update()
+"""
+coaching_logs_search_ddl = [
+    DDL(ANSWERS_FUNCTION_SQL),
+    DDL(SEARCH_VECTOR_FUNCTION_SQL),
+    DDL(SEARCH_VECTOR_TRIGGER_SQL),
+]
+for ddl in coaching_logs_search_ddl:
+    event.listen(
+        Coaching_logs.__table__, "after_create", ddl.execute_if(dialect="postgresql")
+    )
+
+
+class Coaching_log_revisions(Base):
+    """Append-only edit history of coaching logs, see coaching_log_revisions"""
+
+    __tablename__ = "coaching_log_revisions"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    coaching_log_id = Column(Integer, ForeignKey("coaching_logs.id"), nullable=False)
+    revision = Column(Integer, nullable=False)  # the log's row_version after the edit
+    # data is the whole document of a snapshot, else the diff to the revision before
+    snapshot = Column(Boolean, nullable=False)
+    version = Column(String(255))
+    data = Column(JSONB().with_variant(GenericJSON, "sqlite"), nullable=False)
+    edited_by = Column(String(255), ForeignKey("users.username"))
+    edited_at = Column(TIMESTAMP(timezone=True))
+
+    __table_args__ = (
+        # a log's revisions in order, and its latest snapshot up to a revision
+        Index(
+            "ix_coaching_log_revisions_coaching_log_id_revision",
+            "coaching_log_id",
+            "revision",
+            unique=True,
+        ),
+    )
 
 
 class Client_discovery_questionnaire(Base):
@@ -74,7 +232,8 @@ class Client_discovery_questionnaire(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     client_id = Column(Integer, ForeignKey("clients.id"), index=True)
     version = Column(String(255))
-    data = Column(ARRAY(Text, dimensions=2))
+    # sqlite has no arrays, the variant lets benchmarks run on it
+    data = Column(ARRAY(Text, dimensions=2).with_variant(GenericJSON, "sqlite"))
     created_at = Column(TIMESTAMP(timezone=True), default=func.now())
 
 
@@ -87,6 +246,31 @@ class Coaching_log_reimbursement(Base):
     reimbursed_at = Column(TIMESTAMP(timezone=True), default=None)
     reimbursed_via = Column(String(255), default=None)
 
+    __table_args__ = (
+        # a coach's outstanding (or reimbursed) sessions in order
+        Index(
+            "ix_coaching_log_reimbursement_reimbursed_to_reimbursed",
+            "reimbursed_to",
+            "reimbursed",
+            "id",
+        ),
+    )
+
+
+class Coach_summary(Base):
+    """Dashboard counts of a coach, kept up to date by the endpoints changing them"""
+
+    __tablename__ = "coach_summary"
+    coach_username = Column(String(255), ForeignKey("users.username"), primary_key=True)
+    clients = Column(Integer, nullable=False, default=0)
+    unlocked_logs = Column(Integer, nullable=False, default=0)
+    # `sessions` counts the logs created since this first day of a month
+    sessions_month = Column(Date, nullable=False)
+    sessions = Column(Integer, nullable=False, default=0)
+    updated_at = Column(
+        TIMESTAMP(timezone=True), default=func.now(), onupdate=func.now()
+    )
+
 
 def print_tables():
     print(CreateTable(Users.__table__).compile(engine))
@@ -94,3 +278,5 @@ def print_tables():
     print(CreateTable(Coaching_logs.__table__).compile(engine))
     print(CreateTable(Client_discovery_questionnaire.__table__).compile(engine))
     print(CreateTable(Coaching_log_reimbursement.__table__).compile(engine))
+    print(CreateTable(Coaching_log_revisions.__table__).compile(engine))
+    print(CreateTable(Coach_summary.__table__).compile(engine))
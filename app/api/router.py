@@ -6,6 +6,9 @@ from app.api.endpoints import (
     coaching_log,
     clients,
     settings,
+    metrics,
+    reimbursement,
+    dashboard,
 )
 
 api_router = APIRouter()
@@ -21,4 +24,12 @@ api_router.include_router(
 
 api_router.include_router(clients.router, prefix="/clients", tags=["Clients"])
 
+api_router.include_router(
+    reimbursement.router, prefix="/reimbursement", tags=["Reimbursement"]
+)
+
+api_router.include_router(dashboard.router, prefix="/dashboard", tags=["Dashboard"])
+
 api_router.include_router(settings.router, prefix="/settings", tags=["Settings"])
+
+api_router.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
@@ -0,0 +1,110 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Generic, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class CacheBackend:
+    """Shared store behind a TTLCache (e.g. redis), so entries and invalidations
+    are shared between workers. Values are plain dicts.
+    """
+
+    async def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class RedisCacheBackend(CacheBackend):
+    """CacheBackend on redis, requires the `redis` package"""
+
+    def __init__(self, url: str, prefix: str = "") -> None:
+        import redis.asyncio  # optional dependency, only needed for this backend
+
+        self._redis = redis.asyncio.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = await self._redis.get(self._prefix + key)
+        if value is not None:
+            return json.loads(value)
+
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        await self._redis.set(
+            self._prefix + key, json.dumps(value, default=str), px=int(ttl * 1000)
+        )
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(self._prefix + key)
+
+
+class TTLCache(Generic[Model]):
+    """In-process LRU cache of pydantic models whose entries expire after `ttl` seconds.
+
+    With a backend, misses fall through to the shared store and invalidations are
+    propagated to it. Other workers' in-process copies still live until they expire,
+    so keep `ttl` short.
+    """
+
+    def __init__(
+        self,
+        model: Type[Model],
+        ttl: float,
+        max_size: int,
+        backend: Optional[CacheBackend] = None,
+    ) -> None:
+        self.model = model
+        self.ttl = ttl
+        self.max_size = max_size
+        self.backend = backend
+        self._entries: OrderedDict[str, Tuple[float, Model]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Model]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self.backend is not None:
+            data = await self.backend.get(key)
+            if data is not None:
+                value = self.model(**data)
+                self._store(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+
+    async def set(self, key: str, value: Model) -> None:
+        self._store(key, value)
+        if self.backend is not None:
+            await self.backend.set(key, value.dict(), self.ttl)
+
+    async def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self.backend is not None:
+            await self.backend.delete(key)
+
+    def clear(self) -> None:
+        """Drop the in-process entries, the shared backend is left untouched"""
+
+        self._entries.clear()
+
+    def _store(self, key: str, value: Model) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
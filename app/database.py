@@ -1,14 +1,22 @@
 import os
+import time
+from typing import AsyncIterator
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from dotenv import load_dotenv
 
 load_dotenv(".env")
-engine = create_engine(
-    "postgresql://{}:{}@{}:{}/{}".format(
+# DATABASE_URL (an async driver URL, e.g. sqlite+aiosqlite:///bench.db) overrides DB_*
+DATABASE_URL = make_url(
+    os.environ.get("DATABASE_URL")
+    or "postgresql+asyncpg://{}:{}@{}:{}/{}".format(
         os.environ.get("DB_USER"),
         os.environ.get("DB_PASSWORD"),
         os.environ.get("DB_HOST"),
@@ -17,6 +25,91 @@ engine = create_engine(
     )
 )
 
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))  # seconds
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", -1))  # seconds, -1 never
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "false").lower() == "true"
+DB_STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 0))  # ms, 0 off
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long checkouts wait for a connection,
+    either for one to be returned to the pool or for a new one to be opened
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.overflow_checkouts = 0  # checkouts served beyond pool_size
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        self.checkouts += 1
+        if self.overflow() > 0:
+            self.overflow_checkouts += 1
+        return conn
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": self.size(),
+            "max_overflow": self._max_overflow,
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "checkouts": self.checkouts,
+            "overflow_checkouts": self.overflow_checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+connect_args = {}
+if DATABASE_URL.get_backend_name() == "postgresql":
+    connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT)}
+
+# sync engine with the default driver, used by scripts such as fake_db_sql.py
+engine = create_engine(DATABASE_URL.set(drivername=DATABASE_URL.get_backend_name()))
+
+# async engine, used by the API so queries don't block the event loop
+async_engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=InstrumentedPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args=connect_args,
+)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+AsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine,
+    class_=AsyncSession,
+)
+
 Base = declarative_base()
+
+
+# Dependency
+async def get_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from dotenv import load_dotenv
+
+load_dotenv(".env")
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+HASH_POOL_TYPE = os.environ.get("HASH_POOL_TYPE", "thread")  # "thread" or "process"
+HASH_POOL_SIZE = int(os.environ.get("HASH_POOL_SIZE", os.cpu_count() or 1))
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", 100))
+
+# pinning min/max rounds to the configured cost makes passlib flag any hash made
+# with another cost as needing an update, which drives rehash-on-login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+def hash_password(password: str) -> str:
+    """Hash the password with the configured bcrypt cost (blocking)"""
+
+    return pwd_context.hash(password)
+
+
+def verify_and_update(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """Verify the password (blocking), returns a new hash if the stored one is outdated"""
+
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class HashPoolFull(Exception):
+    """Too many hashing jobs are already waiting for a worker"""
+
+
+class PasswordHasher:
+    """Run bcrypt jobs in a bounded worker pool so they don't block the event loop.
+
+    At most `pool_size` jobs run at once, at most `queue_limit` jobs wait for a
+    worker; anything beyond that is rejected with HashPoolFull.
+    """
+
+    def __init__(self, pool_type: str, pool_size: int, queue_limit: int) -> None:
+        if pool_type not in ("thread", "process"):
+            raise ValueError(f"Unknown hash pool type: {pool_type}")
+        self.pool_type = pool_type
+        self.pool_size = pool_size
+        self.queue_limit = queue_limit
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        # created lazily so importing this module doesn't spawn workers
+        if self._executor is None:
+            if self.pool_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.pool_size, thread_name_prefix="bcrypt"
+                )
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) in the pool once a worker slot is free"""
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.pool_size)
+        if self.queued >= self.queue_limit:
+            self.rejected += 1
+            raise HashPoolFull()
+
+        self.queued += 1
+        start = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.wait_seconds_total += time.perf_counter() - start
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify_and_update(
+        self, plain_password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        return await self.run(verify_and_update, plain_password, hashed_password)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pool_type": self.pool_type,
+            "pool_size": self.pool_size,
+            "queue_limit": self.queue_limit,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_seconds_total": self.wait_seconds_total,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+hasher = PasswordHasher(HASH_POOL_TYPE, HASH_POOL_SIZE, HASH_QUEUE_LIMIT)
@@ -0,0 +1,159 @@
+import logging
+import os
+import time
+from collections import Counter as StatementCounter
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+from app.database import async_engine
+from app.hashing import hasher
+
+logger = logging.getLogger(__name__)
+
+# a statement run this many times in one request is reported as a likely N+1 query
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 5))
+
+REQUESTS = Counter("http_requests", "HTTP requests", ["method", "route", "status"])
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route"]
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being handled", ["method"]
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries per HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, float("inf")),
+)
+REQUEST_QUERY_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent in database queries per HTTP request",
+    ["route"],
+)
+REPEATED_QUERIES = Counter(
+    "http_request_repeated_queries",
+    f"Statements run at least {N_PLUS_ONE_THRESHOLD} times in one request (N+1)",
+    ["route"],
+)
+
+
+class RequestStats:
+    """Database usage of the request being handled"""
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.statements: StatementCounter[str] = StatementCounter()
+
+
+# mutated (never re-set) by the engine hooks, which run in a copy of the context
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += duration
+        stats.statements[statement] += 1
+
+
+class PrometheusMiddleware:
+    """Record latency, status and database usage of each request by route"""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_with_status(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        REQUESTS_IN_PROGRESS.labels(method).inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            REQUESTS_IN_PROGRESS.labels(method).dec()
+            _request_stats.reset(token)
+
+            # path template of the matched route, so ids don't explode the labels
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUESTS.labels(method, route, status_code).inc()
+            REQUEST_DURATION.labels(method, route).observe(duration)
+            REQUEST_QUERIES.labels(route).observe(stats.queries)
+            REQUEST_QUERY_DURATION.labels(route).observe(stats.query_seconds)
+            for statement, count in stats.statements.items():
+                if count >= N_PLUS_ONE_THRESHOLD:
+                    REPEATED_QUERIES.labels(route).inc()
+                    logger.warning(
+                        "Possible N+1 query in %s %s, ran %d times: %s",
+                        method,
+                        route,
+                        count,
+                        statement,
+                    )
+
+
+class PoolCollector:
+    """Expose the connection pool and password hashing pool stats"""
+
+    def collect(self):
+        pool = async_engine.pool.stats()
+        for name in ("checked_out", "checked_in", "overflow"):
+            yield GaugeMetricFamily(
+                f"db_pool_{name}", f"Database pool connections {name}", pool[name]
+            )
+        for name in ("checkouts", "overflow_checkouts", "timeouts"):
+            yield CounterMetricFamily(
+                f"db_pool_{name}", f"Database pool {name}", pool[name]
+            )
+        yield CounterMetricFamily(
+            "db_pool_wait_seconds",
+            "Time spent getting a database connection",
+            pool["wait_seconds_total"],
+        )
+
+        hashing = hasher.stats()
+        for name in ("queued", "in_flight"):
+            yield GaugeMetricFamily(
+                f"password_hash_{name}", f"Password hashing jobs {name}", hashing[name]
+            )
+        for name in ("completed", "rejected"):
+            yield CounterMetricFamily(
+                f"password_hash_{name}", f"Password hashing jobs {name}", hashing[name]
+            )
+        yield CounterMetricFamily(
+            "password_hash_wait_seconds",
+            "Time password hashing jobs waited for a worker",
+            hashing["wait_seconds_total"],
+        )
+
+
+REGISTRY.register(PoolCollector())
@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from sqlalchemy import bindparam, func, literal_column, select, update
+from sqlalchemy.schema import CreateIndex
+
+from app.api import models
+from app.api.coaching_log_versions import (
+    CURRENT_COACHING_LOG_VERSION,
+    upgrade_coaching_log_data,
+)
+from app.database import AsyncSessionLocal, async_engine
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = int(os.environ.get("DB_MIGRATION_BATCH_SIZE", 500))
+MIGRATION_PAUSE = float(os.environ.get("DB_MIGRATION_PAUSE", 0.1))  # seconds
+
+# what an existing database predates on the tables it already has (postgres only).
+# Missing tables and sequences are created from the models, the indexes are built
+# once the columns are filled, cheaper than updating them row by row
+SCHEMA_SQL = [
+    models.PG_TRGM_SQL,
+    "ALTER TABLE users "
+    "ADD COLUMN IF NOT EXISTS token_version integer NOT NULL DEFAULT 0",
+    "ALTER TABLE clients "
+    "ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone DEFAULT now()",
+    "ALTER TABLE coaching_logs ADD COLUMN IF NOT EXISTS data_jsonb jsonb",
+    "ALTER TABLE coaching_logs "
+    "ADD COLUMN IF NOT EXISTS row_version integer NOT NULL DEFAULT 1",
+    "ALTER TABLE coaching_logs ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    models.ANSWERS_FUNCTION_SQL,
+    models.SEARCH_VECTOR_FUNCTION_SQL,
+    # no CREATE OR REPLACE TRIGGER before postgres 14
+    """
+DO $$ BEGIN
+    IF NOT EXISTS (
+        SELECT FROM pg_trigger
+        WHERE tgrelid = 'coaching_logs'::regclass
+        AND tgname = 'coaching_logs_search_vector'
+    ) THEN
+        %s;
+    END IF;
+END $$
+""" % models.SEARCH_VECTOR_TRIGGER_SQL.strip(),
+]
+
+
+# indexes the models no longer declare, dropped once their replacements are built
+DROPPED_INDEXES = [
+    # prefixes of the (client_id, ...) and (created_by, ...) indexes of coaching_logs
+    "ix_coaching_logs_client_id",
+    "ix_coaching_logs_created_by",
+]
+
+
+async def upgrade_schema() -> None:
+    """Create the tables and sequences the database lacks, then add the newer
+    columns, functions and triggers of SCHEMA_SQL to the existing tables
+    """
+
+    async with async_engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with async_engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for sql in SCHEMA_SQL:
+                await conn.exec_driver_sql(sql)
+
+
+def create_index_sql(index, dialect) -> str:
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS of a model's index. Concurrently isn't
+    an option of the Index itself, create_all runs in a transaction which forbids it.
+    """
+
+    sql = str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect))
+    return sql.replace("INDEX IF NOT EXISTS", "INDEX CONCURRENTLY IF NOT EXISTS", 1)
+
+
+async def create_indexes() -> None:
+    """Build every index of the models the database lacks, concurrently so that the
+    tables stay writable meanwhile, then drop the DROPPED_INDEXES. Postgres only.
+    """
+
+    async with async_engine.connect() as conn:
+        if conn.dialect.name != "postgresql":
+            return
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for table in models.Base.metadata.sorted_tables:
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                await conn.exec_driver_sql(create_index_sql(index, conn.dialect))
+        for name in DROPPED_INDEXES:
+            await conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+async def migrate_coaching_logs(
+    batch_size: int = MIGRATION_BATCH_SIZE, pause: float = MIGRATION_PAUSE
+) -> int:
+    """Upgrade the coaching logs without data_jsonb to the current version, and copy
+    their data there. Returns the number of logs migrated.
+
+    Works in batches of `batch_size` logs, each in its own transaction, sleeping
+    `pause` seconds in between to leave the database to the API. Progress is the
+    data_jsonb column itself, so an interrupted migration just runs again. Locked
+    rows are skipped rather than waited for, so several migrations can run at once.
+    """
+
+    logs = models.Coaching_logs
+    # rows already at the current version only need data_jsonb, rewriting their
+    # data would needlessly fire the search vector trigger
+    copy_data = (
+        update(logs)
+        .where(logs.id == bindparam("log_id"))
+        .values(data_jsonb=bindparam("new_data_jsonb"))
+    )
+    upgrade_data = copy_data.values(
+        version=CURRENT_COACHING_LOG_VERSION, data=bindparam("new_data")
+    )
+    migrated = 0
+    after_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(logs.id, logs.version, logs.data)
+                .filter(logs.data_jsonb.is_(None), logs.id > after_id)
+                .order_by(logs.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            rows = result.all()
+            if not rows:
+                break
+
+            copies, upgrades = [], []
+            for row in rows:
+                if row.data is None:
+                    continue
+                try:
+                    data = upgrade_coaching_log_data(row.version, row.data)
+                except ValueError as error:
+                    logger.warning("Coaching log %s not migrated: %s", row.id, error)
+                    continue
+                if row.version == CURRENT_COACHING_LOG_VERSION:
+                    copies.append({"log_id": row.id, "new_data_jsonb": data})
+                else:
+                    upgrades.append(
+                        {"log_id": row.id, "new_data": data, "new_data_jsonb": data}
+                    )
+            if copies:
+                await db.execute(copy_data, copies)
+            if upgrades:
+                await db.execute(upgrade_data, upgrades)
+            await db.commit()
+
+        migrated += len(copies) + len(upgrades)
+        after_id = rows[-1].id
+        if pause:
+            await asyncio.sleep(pause)
+    return migrated
+
+
+async def backfill_search_vectors(
+    batch_size: int = MIGRATION_BATCH_SIZE, pause: float = MIGRATION_PAUSE
+) -> int:
+    """Fill search_vector of the logs written before its trigger existed, in batches
+    like migrate_coaching_logs. Returns the number of logs filled. Postgres only.
+    """
+
+    logs = models.Coaching_logs
+    filled = 0
+    after_id = 0
+    while True:
+        batch = (
+            select(logs.id)
+            .filter(logs.search_vector.is_(None), logs.id > after_id)
+            .order_by(logs.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(logs)
+                .where(logs.id.in_(batch.scalar_subquery()))
+                .values(
+                    search_vector=func.to_tsvector(
+                        literal_column("'english'"),
+                        func.coaching_log_answers(logs.data),
+                    )
+                )
+                .returning(logs.id)
+                .execution_options(synchronize_session=False)
+            )
+            ids = result.scalars().all()
+            await db.commit()
+        if not ids:
+            break
+
+        filled += len(ids)
+        after_id = max(ids)
+        if pause:
+            await asyncio.sleep(pause)
+    logger.info("Search vectors of %s coaching logs filled", filled)
+    return filled
+
+
+async def migrate(
+    batch_size: int = MIGRATION_BATCH_SIZE, pause: float = MIGRATION_PAUSE
+) -> int:
+    """Upgrade an existing database to the models: upgrade_schema, then the data
+    backfills, then create_indexes. Every step is safe to interrupt and run again.
+    Returns the number of coaching logs migrated.
+    """
+
+    await upgrade_schema()
+    migrated = await migrate_coaching_logs(batch_size, pause)
+    if async_engine.dialect.name == "postgresql":
+        await backfill_search_vectors(batch_size, pause)
+    await create_indexes()
+    return migrated
+
+
+async def run_migration() -> None:
+    """migrate as a background task of the API"""
+
+    try:
+        migrated = await migrate()
+    except Exception:
+        logger.exception("Database migration failed, it resumes on the next run")
+    else:
+        logger.info("Database migration done, %s coaching logs migrated", migrated)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Upgrade an existing database to the current schema: add the "
+        "newer tables, columns and triggers, upgrade coaching logs to the current "
+        "version, fill data_jsonb and the search vectors, and build the indexes. "
+        "Safe to interrupt and run again."
+    )
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=MIGRATION_PAUSE)
+    args = parser.parse_args()
+
+    async def main():
+        migrated = await migrate(args.batch_size, args.pause)
+        print(f"{migrated} coaching logs migrated")
+        await async_engine.dispose()
+
+    asyncio.run(main())
@@ -1,5 +1,150 @@
+import base64
+import hashlib
+import json
+import os
+from datetime import date
+from typing import Any, AsyncIterator, Iterable, Optional, Type
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+JSON_RESPONSE = os.environ.get("JSON_RESPONSE", "default")  # "default" or "orjson"
+
+
 def convert_db_list_to_py_list(db_list):
     result = []
     for item in db_list:
         result.append(item.__dict__)
     return result
+
+
+STREAM_BATCH_SIZE = 1000  # rows fetched per round trip from a server-side cursor
+
+
+async def stream_ndjson(rows, to_json) -> AsyncIterator[str]:
+    """Yield each row of an async (streamed) result as a line of JSON"""
+
+    async for row in rows:
+        yield to_json(row) + "\n"
+
+
+def check_page_limit(limit: int, maximum: Optional[int] = None) -> None:
+    """400 unless `limit` is a page size up to `maximum`. Without a maximum, -1 is
+    allowed too, for everything.
+    """
+
+    if maximum is None:
+        if limit != -1 and limit < 1:
+            raise HTTPException(
+                status_code=400, detail="limit must be -1 or at least 1"
+            )
+    elif not 0 < limit <= maximum:
+        raise HTTPException(status_code=400, detail=f"limit must be 1 to {maximum}")
+
+
+def encode_cursor(*values) -> str:
+    """Opaque pagination cursor holding the sort key of the last row of a page"""
+
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """Inverse of encode_cursor, raises ValueError for a malformed cursor"""
+
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def make_etag(*version_markers) -> str:
+    """Weak ETag of a response, from whatever changes whenever its content does"""
+
+    digest = hashlib.sha1(json.dumps(version_markers, default=str).encode())
+    return f'W/"{digest.hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match holds `etag` (compared weakly)"""
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def if_match_holds(request: Request, etag: str) -> bool:
+    """Whether the request's If-Match holds `etag` (compared strongly)"""
+
+    tags = [tag.strip() for tag in request.headers.get("if-match", "").split(",")]
+    return "*" in tags or etag in tags
+
+
+def set_etag(response: Response, etag: str) -> None:
+    # no-cache: keep the response but revalidate it on every use
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+
+def not_modified(etag: str) -> Response:
+    response = Response(status_code=304)
+    set_etag(response, etag)
+    return response
+
+
+def merge_patch(target: Any, patch: Any) -> Any:
+    """Apply a JSON merge patch (RFC 7396): null removes a key, objects merge"""
+
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def model_columns(model: Type[BaseModel], entity) -> list:
+    """The ORM entity's columns named like the fields of the response model"""
+
+    return [getattr(entity, name) for name in model.__fields__]
+
+
+def model_dict(model: Type[BaseModel], obj, exclude: Iterable[str] = ()) -> dict:
+    """The ORM object's attributes named like the fields of the response model"""
+
+    return {
+        name: getattr(obj, name) for name in model.__fields__ if name not in exclude
+    }
+
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, date):  # and datetime
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def json_dumps(content: Any) -> str:
+    """Encode rows from the database as JSON, with orjson if JSON_RESPONSE=orjson"""
+
+    if JSON_RESPONSE == "orjson":
+        import orjson  # optional dependency
+
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(
+        content, default=_json_default, ensure_ascii=False, separators=(",", ":")
+    )
+
+
+class TrustedJSONResponse(JSONResponse):
+    """JSON response of data read from our own database, which skips FastAPI's
+    response_model validation. The endpoint's response_model still documents the
+    schema, so the content must already have its shape (see model_columns).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content).encode("utf-8")
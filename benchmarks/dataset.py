@@ -0,0 +1,13 @@
+"""Shape of the synthetic benchmark dataset, generated by fake_db_sql.py."""
+
+from fake_db_sql import (  # noqa: F401
+    DEFAULT_CLIENTS_PER_COACH,
+    DEFAULT_LOGS_PER_CLIENT,
+    COACHES_PER_SCALE,
+    FAKE_PASSWORD as PASSWORD,
+    GENERATED_ADMIN_USERNAME as ADMIN_USERNAME,
+    clients_of_coach,
+    coach_of_client,
+    coach_username,
+    fake_log_data as log_data,
+)
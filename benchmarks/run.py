@@ -0,0 +1,223 @@
+"""Drive the core API flows against a seeded database and report latency percentiles.
+
+    python -m benchmarks.run --scale 100 --output results.json
+    python -m benchmarks.run --url http://localhost:8000 --baseline results.json
+
+The dataset options must match those given to fake_db_sql.py when seeding. Without
+--url the app is served in-process. With --baseline, the run fails when a
+scenario's p50 or p99 regressed by more than --tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from benchmarks.dataset import (
+    ADMIN_USERNAME,
+    COACHES_PER_SCALE,
+    DEFAULT_CLIENTS_PER_COACH,
+    PASSWORD,
+    clients_of_coach,
+    coach_username,
+    log_data,
+)
+
+
+class VirtualUser:
+    """A logged in HTTP client acting as one coach (or the admin)"""
+
+    def __init__(self, http: httpx.AsyncClient, coach: Optional[int], clients: range):
+        self.http = http
+        self.coach = coach
+        self.clients = clients
+        self.rng = random.Random(coach)
+
+    async def login(self) -> None:
+        username = ADMIN_USERNAME if self.coach is None else coach_username(self.coach)
+        response = await self.http.post(
+            "/auth/token", data={"username": username, "password": PASSWORD}
+        )
+        response.raise_for_status()
+
+
+async def scenario_login(user: VirtualUser) -> None:
+    await user.login()
+
+
+async def scenario_clients_list(user: VirtualUser) -> None:
+    (await user.http.get("/clients/list")).raise_for_status()
+
+
+async def scenario_coaching_log_list(user: VirtualUser) -> None:
+    client_id = user.rng.choice(user.clients)
+    (await user.http.get(f"/coaching-log/list/{client_id}")).raise_for_status()
+
+
+async def scenario_create_edit_log(user: VirtualUser) -> None:
+    client_id = user.rng.choice(user.clients)
+    data = log_data(client_id, user.rng.randrange(1000))
+    response = await user.http.post(f"/coaching-log/create/{client_id}", json=data)
+    response.raise_for_status()
+    data["ansQ9Others"] = "edited"
+    response = await user.http.put(f"/coaching-log/edit/{client_id}", json=data)
+    response.raise_for_status()
+
+
+async def scenario_autosave_log(user: VirtualUser) -> None:
+    """A new log saved a few answers at a time, as the frontend's autosave does"""
+
+    client_id = user.rng.choice(user.clients)
+    data = log_data(client_id, user.rng.randrange(1000))
+    response = await user.http.post(f"/coaching-log/create/{client_id}", json=data)
+    response.raise_for_status()
+    for answer in ("ansQ7Exercise", "ansQ8Environment", "ansQ9Others"):
+        response = await user.http.patch(
+            f"/coaching-log/edit/{client_id}",
+            json={answer: "autosaved"},
+            headers={"If-Match": response.headers["ETag"]},
+        )
+        response.raise_for_status()
+
+
+async def scenario_admin_list_all(user: VirtualUser) -> None:
+    (
+        await user.http.get("/clients/list-all", params={"limit": 1000})
+    ).raise_for_status()
+    (await user.http.get("/users/list-all", params={"limit": 100})).raise_for_status()
+
+
+# name: (operation, runs as admin)
+SCENARIOS: dict[str, tuple[Callable[[VirtualUser], Awaitable[None]], bool]] = {
+    "login": (scenario_login, False),
+    "clients_list": (scenario_clients_list, False),
+    "coaching_log_list": (scenario_coaching_log_list, False),
+    "create_edit_log": (scenario_create_edit_log, False),
+    "autosave_log": (scenario_autosave_log, False),
+    "admin_list_all": (scenario_admin_list_all, True),
+}
+
+
+def make_http_client(url: Optional[str]) -> httpx.AsyncClient:
+    if url is not None:
+        return httpx.AsyncClient(base_url=url, timeout=60)
+    from main import app  # in-process, imported late so --url runs don't need the app
+
+    return httpx.AsyncClient(app=app, base_url="http://benchmark", timeout=60)
+
+
+async def run_scenario(name: str, args: argparse.Namespace) -> dict:
+    operation, as_admin = SCENARIOS[name]
+    rng = random.Random(name)
+    users = []
+    for _ in range(args.concurrency):
+        coach = None if as_admin else rng.randrange(args.coaches)
+        clients = range(1, args.clients + 1)
+        if coach is not None:
+            clients = clients_of_coach(coach, args.coaches, args.clients)
+        user = VirtualUser(make_http_client(args.url), coach, clients)
+        await user.login()
+        users.append(user)
+
+    latencies: list[float] = []
+    errors = 0
+    remaining = args.requests
+
+    async def worker(user: VirtualUser) -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                await operation(user)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(user) for user in users))
+    elapsed = time.perf_counter() - start
+    for user in users:
+        await user.http.aclose()
+
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentiles[49] * 1000 if percentiles else None,
+        "p99_ms": percentiles[98] * 1000 if percentiles else None,
+    }
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    found = []
+    for name, result in results.items():
+        for key in ("p50_ms", "p99_ms"):
+            before = baseline.get(name, {}).get(key)
+            after = result[key]
+            if before and after and after > before * (1 + tolerance):
+                found.append(f"{name} {key}: {before:.1f} -> {after:.1f}")
+    return found
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="server to benchmark, default in-process")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--coaches", type=int, help="overrides --scale")
+    parser.add_argument(
+        "--clients-per-coach", type=int, default=DEFAULT_CLIENTS_PER_COACH
+    )
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--requests", type=int, default=1000, help="operations per scenario"
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--baseline", help="results json of an earlier run to compare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    args.coaches = args.coaches or COACHES_PER_SCALE * args.scale
+    args.clients = args.coaches * args.clients_per_coach
+
+    results = {}
+    print(
+        f"{'scenario':<20}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+    )
+    for name in args.scenarios:
+        result = results[name] = await run_scenario(name, args)
+        print(
+            f"{name:<20}{result['requests']:>10}{result['errors']:>8}"
+            f"{result['throughput']:>10.1f}{result['p50_ms'] or 0:>10.1f}"
+            f"{result['p99_ms'] or 0:>10.1f}"
+        )
+
+    if args.url is None:
+        from app.database import async_engine
+
+        await async_engine.dispose()  # pooled connections would keep the process alive
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print("REGRESSION", regression)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,141 @@
+"""Time JSON serialization of the large list responses and compare payload sizes.
+
+    python -m benchmarks.serialization --rows 10000
+
+Runs the same validation and encoding FastAPI does for a response_model, then
+renders the result with the default JSONResponse and with ORJSONResponse. "trusted"
+renders the rows directly, as TrustedJSONResponse does without validation. Also
+reports the gzip and brotli sizes the compression middlewares would send.
+No database is needed.
+"""
+
+import argparse
+import asyncio
+import gzip
+import time
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.api.endpoints.clients import ClientDetails
+from app.api.endpoints.coaching_log import CoachingLog
+from app.api.endpoints.users import UserDetails
+from app.util import TrustedJSONResponse
+from benchmarks.dataset import coach_username, log_data
+
+
+def client_rows(count: int) -> list[dict]:
+    return [
+        dict(
+            id=client_id,
+            coach_username=coach_username(client_id % 20),
+            first_name="Client",
+            last_name=str(client_id),
+            email=f"client{client_id}@example.com",
+            mobile_phone=f"+852 {client_id:08d}",
+            sex="F",
+            age=30,
+            current_location="HK",
+        )
+        for client_id in range(count)
+    ]
+
+
+def user_rows(count: int) -> list[dict]:
+    return [
+        dict(
+            id=coach,
+            username=coach_username(coach),
+            first_name="Coach",
+            last_name=str(coach),
+            email=f"coach{coach}@example.com",
+            role="coach",
+            clients_list=[
+                dict(id=client_id, first_name="Client", last_name=str(client_id))
+                for client_id in range(coach * 50, coach * 50 + 50)
+            ],
+        )
+        for coach in range(count)
+    ]
+
+
+def log_rows(count: int) -> list[dict]:
+    now = datetime.now(timezone.utc)
+    return [
+        dict(
+            id=log_id,
+            version="1.1",
+            data=log_data(1, log_id),
+            locked=True,
+            created_by="coach",
+            created_at=now,
+            edited_by="coach",
+            edited_at=now,
+            row_version=1,
+        )
+        for log_id in range(count)
+    ]
+
+
+async def measure(model, rows: list[dict], repeat: int) -> dict:
+    field = create_response_field(name="response", type_=List[model])
+    timings = {"validate": 0.0, "json": 0.0, "orjson": 0.0, "trusted": 0.0}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        content = await serialize_response(field=field, response_content=rows)
+        timings["validate"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        body = JSONResponse(content).body
+        timings["json"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        ORJSONResponse(content).body
+        timings["orjson"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        TrustedJSONResponse(rows).body
+        timings["trusted"] += time.perf_counter() - start
+
+    result = {f"{name}_ms": t / repeat * 1000 for name, t in timings.items()}
+    result["bytes"] = len(body)
+    result["gzip_bytes"] = len(gzip.compress(body, compresslevel=9))
+    try:
+        import brotli
+
+        result["brotli_bytes"] = len(brotli.compress(body, quality=4))
+    except ImportError:
+        result["brotli_bytes"] = None
+    return result
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = {
+        "clients/list-all": (ClientDetails, client_rows(args.rows)),
+        "users/list-all": (UserDetails, user_rows(args.rows // 50)),
+        "coaching-log/list": (CoachingLog, log_rows(args.rows // 10)),
+    }
+    print(
+        f"{'payload':<20}{'rows':>7}{'validate ms':>13}{'json ms':>9}{'orjson ms':>11}"
+        f"{'trusted ms':>12}{'bytes':>11}{'gzip':>10}{'brotli':>10}"
+    )
+    for name, (model, rows) in payloads.items():
+        r = await measure(model, rows, args.repeat)
+        print(
+            f"{name:<20}{len(rows):>7}{r['validate_ms']:>13.1f}{r['json_ms']:>9.1f}"
+            f"{r['orjson_ms']:>11.1f}{r['trusted_ms']:>12.1f}{r['bytes']:>11}"
+            f"{r['gzip_bytes']:>10}"
+            f"{r['brotli_bytes'] or '-':>10}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,15 @@
+import argparse
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
 from app.database import SessionLocal, engine
 from app.api import models
-from app.api.auth import get_password_hash
+from app.hashing import hash_password
+
+FAKE_PASSWORD = "123123"
 
 
 def reset_tables():
@@ -13,7 +22,7 @@ def test():
     # test add user and client and relationship
     user = models.Users(
         username="first_user",
-        hashed_password=get_password_hash("123123"),
+        hashed_password=hash_password("123123"),
         first_name="first",
         last_name="last",
         email="EMAIL",
@@ -22,7 +31,7 @@ def test():
     )
     user2 = models.Users(
         username="second_user",
-        hashed_password=get_password_hash("123123"),
+        hashed_password=hash_password("123123"),
         first_name="first2",
         last_name="last2",
         email="EMAIL2",
@@ -45,9 +54,10 @@ def test():
 
 def initialize_fake_db():
     db = SessionLocal()
+    hashed_password = hash_password(FAKE_PASSWORD)  # hash once, bcrypt is slow
     fake_user_1 = models.Users(
         username="fake_user_1",
-        hashed_password=get_password_hash("123123"),
+        hashed_password=hashed_password,
         first_name="John",
         last_name="Doe",
         email="johndoe@example.com",
@@ -57,7 +67,7 @@ def initialize_fake_db():
     db.add(fake_user_1)
     fake_user_2 = models.Users(
         username="fake_user_2",
-        hashed_password=get_password_hash("123123"),
+        hashed_password=hashed_password,
         first_name="John",
         last_name="Doe",
         email="johndoe@example.com",
@@ -296,6 +306,231 @@ def initialize_fake_db():
     return
 
 
+### ---------- generated dataset ----------
+GENERATED_ADMIN_USERNAME = "fake_admin"
+
+# scale 1: 20 coaches with 50 clients each, 10 coaching logs per client
+COACHES_PER_SCALE = 20
+DEFAULT_CLIENTS_PER_COACH = 50
+DEFAULT_LOGS_PER_CLIENT = 10
+
+
+def coach_username(coach: int) -> str:
+    return f"fake_coach_{coach}"
+
+
+def coach_of_client(client_id: int, coaches: int) -> int:
+    """Clients are dealt round-robin to coaches, client ids start at 1"""
+
+    return (client_id - 1) % coaches
+
+
+def clients_of_coach(coach: int, coaches: int, clients: int) -> range:
+    return range(coach + 1, clients + 1, coaches)
+
+
+def fake_log_data(client_id: int, session: int) -> dict:
+    """A coaching log payload of realistic size"""
+
+    answer = f"Client {client_id} session {session}: " + "notes " * 40
+    return {
+        "ansDate": f"2021-{session % 12 + 1:02d}-01T16:00:00.000Z",
+        "ansSessionFormat": "Online",
+        "ansMeetingVenue": "N/A",
+        "ansSessionDuration": "60",
+        "ansQ1Introduction": answer,
+        "ansQ2Dermatology": answer,
+        "ansQ3Pharmacology": answer,
+        "ansQ4Nutrition": answer,
+        "ansQ5Stress": answer,
+        "ansQ6Sleep": answer,
+        "ansQ7Exercise": answer,
+        "ansQ8Environment": answer,
+        "ansQ9Others": answer,
+    }
+
+
+def _copy_value(value):
+    """Python value as COPY csv text, None stays None (an unquoted empty field = NULL)"""
+
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, dict):
+        return json.dumps(value)
+    if isinstance(value, list):  # 2D text array
+        return "{%s}" % ",".join(
+            "{%s}" % ",".join(json.dumps(item) for item in row) for row in value
+        )
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def bulk_insert(conn, table, columns: list[str], rows, batch_size: int) -> int:
+    """Insert rows (tuples in `columns` order) in batches, returns the row count.
+    Streams the batches with COPY on postgres, executemany elsewhere.
+    """
+
+    use_copy = conn.dialect.name == "postgresql"
+    count = 0
+    batch = []
+
+    def flush():
+        if use_copy:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in batch:
+                writer.writerow([_copy_value(value) for value in row])
+            buffer.seek(0)
+            with conn.connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH CSV",
+                    buffer,
+                )
+        else:
+            conn.execute(table.insert(), [dict(zip(columns, row)) for row in batch])
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            flush()
+            count += len(batch)
+            batch = []
+    if batch:
+        flush()
+        count += len(batch)
+    return count
+
+
+def generate_fake_db(
+    coaches: int,
+    clients_per_coach: int,
+    logs_per_client: int,
+    batch_size: int = 10000,
+) -> None:
+    """Bulk load a generated dataset: an admin, coaches with their clients, each client
+    with a discovery questionnaire and coaching logs (the latest one unlocked) with
+    their reimbursements. Every user's password is FAKE_PASSWORD.
+    """
+
+    hashed_password = hash_password(FAKE_PASSWORD)  # hash once, bcrypt is slow
+    clients = coaches * clients_per_coach
+    start_date = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+
+    def user_rows():
+        yield (
+            1, GENERATED_ADMIN_USERNAME, hashed_password, "Fake", "Admin",
+            "admin@example.com", "admin", False, None, now,
+        )  # fmt: skip
+        for coach in range(coaches):
+            yield (
+                coach + 2, coach_username(coach), hashed_password, "Coach",
+                str(coach), f"coach{coach}@example.com", "coach", False,
+                GENERATED_ADMIN_USERNAME, now,
+            )  # fmt: skip
+
+    def client_rows():
+        for client_id in range(1, clients + 1):
+            yield (
+                client_id, coach_username(coach_of_client(client_id, coaches)),
+                "Client", str(client_id), f"client{client_id}@example.com",
+                f"+852 {client_id:08d}", "F" if client_id % 2 else "M",
+                18 + client_id % 60, "HK", False, GENERATED_ADMIN_USERNAME, now,
+            )  # fmt: skip
+
+    def questionnaire_rows():
+        for client_id in range(1, clients + 1):
+            yield (client_id, "1.1", [["Q1", "Q2"], ["A1", "A2"]], now)
+
+    def log_rows():
+        log_id = 0
+        for client_id in range(1, clients + 1):
+            coach = coach_username(coach_of_client(client_id, coaches))
+            for session in range(logs_per_client):
+                log_id += 1
+                created_at = start_date + timedelta(days=7 * session)
+                # the older half of the logs predate version 1.1
+                version, data = "1.1", fake_log_data(client_id, session)
+                if session < logs_per_client // 2:
+                    version = "1.0"
+                    del data["ansSessionDuration"]
+                yield (
+                    log_id, client_id, version, data,
+                    session != logs_per_client - 1, coach, created_at, coach,
+                    created_at,
+                )  # fmt: skip
+
+    def reimbursement_rows():
+        for log_id in range(1, clients * logs_per_client + 1):
+            client_id = (log_id - 1) // logs_per_client + 1
+            coach = coach_username(coach_of_client(client_id, coaches))
+            yield (log_id, False, coach)
+
+    tables = [
+        (
+            models.Users.__table__,
+            ["id", "username", "hashed_password", "first_name", "last_name",
+             "email", "role", "disabled", "created_by", "created_at"],
+            user_rows(),
+        ),
+        (
+            models.Clients.__table__,
+            ["id", "coach_username", "first_name", "last_name", "email",
+             "mobile_phone", "sex", "age", "current_location", "disabled",
+             "created_by", "created_at"],
+            client_rows(),
+        ),
+        (
+            models.Client_discovery_questionnaire.__table__,
+            ["client_id", "version", "data", "created_at"],
+            questionnaire_rows(),
+        ),
+        (
+            models.Coaching_logs.__table__,
+            ["id", "client_id", "version", "data", "locked", "created_by",
+             "created_at", "edited_by", "edited_at"],
+            log_rows(),
+        ),
+        (
+            models.Coaching_log_reimbursement.__table__,
+            ["coaching_log_id", "reimbursed", "reimbursed_to"],
+            reimbursement_rows(),
+        ),
+    ]  # fmt: skip
+    with engine.begin() as conn:
+        for table, columns, rows in tables:
+            start = time.perf_counter()
+            count = bulk_insert(conn, table, columns, rows, batch_size)
+            print(f"{table.name}: {count} rows in {time.perf_counter() - start:.1f}s")
+        if conn.dialect.name == "postgresql":
+            # ids were given explicitly, move the sequences past them
+            for table in ("users", "coaching_logs"):
+                conn.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"(SELECT max(id) FROM {table}))"
+                )
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reset the database and fill it with fake data. Without options, "
+        "a few hand written rows; with any of them, a generated dataset."
+    )
+    parser.add_argument("--scale", type=int, help=f"{COACHES_PER_SCALE} coaches each")
+    parser.add_argument("--coaches", type=int, help="overrides --scale")
+    parser.add_argument("--clients-per-coach", type=int)
+    parser.add_argument("--logs-per-client", type=int)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
     reset_tables()
-    initialize_fake_db()
+    if args.scale or args.coaches or args.clients_per_coach or args.logs_per_client:
+        generate_fake_db(
+            coaches=args.coaches or COACHES_PER_SCALE * (args.scale or 1),
+            clients_per_coach=args.clients_per_coach or DEFAULT_CLIENTS_PER_COACH,
+            logs_per_client=args.logs_per_client or DEFAULT_LOGS_PER_CLIENT,
+            batch_size=args.batch_size,
+        )
+    else:
+        initialize_fake_db()
@@ -1,12 +1,33 @@
+import asyncio
+import os
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
 
 from app.api.router import api_router
+from app.hashing import hasher
+from app.metrics import PrometheusMiddleware
+from app.migrations import run_migration
+from app.util import JSON_RESPONSE
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
 
 load_dotenv(".env")
+RESPONSE_COMPRESSION = os.environ.get("RESPONSE_COMPRESSION", "none")
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1000))  # bytes
+DB_MIGRATION = os.environ.get("DB_MIGRATION", "false").lower() == "true"
+
+if JSON_RESPONSE == "orjson":
+    import orjson  # noqa: F401  optional dependency, fail at startup if missing
+
+    default_response_class = ORJSONResponse
+elif JSON_RESPONSE == "default":
+    default_response_class = JSONResponse
+else:
+    raise ValueError(f"Unknown JSON_RESPONSE: {JSON_RESPONSE}")
 
-app = FastAPI()
+app = FastAPI(default_response_class=default_response_class)
 
 
 # Set all CORS enabled origins
@@ -17,7 +38,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# responses smaller than COMPRESSION_MIN_SIZE aren't worth compressing
+if RESPONSE_COMPRESSION == "gzip":
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+elif RESPONSE_COMPRESSION == "brotli":
+    from brotli_asgi import BrotliMiddleware  # optional dependency
+
+    # gzip for clients that don't accept br
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+elif RESPONSE_COMPRESSION != "none":
+    raise ValueError(f"Unknown RESPONSE_COMPRESSION: {RESPONSE_COMPRESSION}")
+
+app.add_middleware(PrometheusMiddleware)
+
 
 app.include_router(api_router)
+
+
+@app.on_event("startup")
+async def start_migration() -> None:
+    if DB_MIGRATION:
+        # keep a reference, the event loop only holds a weak one
+        app.state.migration = asyncio.create_task(run_migration())
+
+
+@app.on_event("shutdown")
+def shutdown_hash_pool() -> None:
+    hasher.shutdown()